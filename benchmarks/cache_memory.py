@@ -0,0 +1,185 @@
+# run from the repository root with `python -m benchmarks.cache_memory`
+from __future__ import annotations
+
+import asyncio
+import datetime
+import gc
+import resource
+import subprocess
+import sys
+import typing as t
+
+import hikari
+
+from kangakari.cache import RESOURCES
+from kangakari.cache import CacheProfile
+
+MEMBERS = 50_000
+CHANNELS = 500
+ROLES = 250
+EMOJIS = 100
+GUILD_ID = 1 << 40
+
+CONFIGURATIONS: dict[str, CacheProfile | None] = {
+    # what the bot did before it had a profile: every intent, everything in memory
+    "everything": None,
+    "default": CacheProfile.parse(None),
+    "nothing": CacheProfile({name: "none" for name in RESOURCES}),
+}
+
+
+class _Shard:
+    # GUILD_CREATE only reads the shard's ID when the guild isn't chunked
+    id = 0
+
+    async def request_guild_members(self, *args: t.Any, **kwargs: t.Any) -> None:
+        pass
+
+
+def guild_create() -> dict[str, t.Any]:
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    roles = [
+        {
+            "id": str(GUILD_ID + i),
+            "name": f"role {i}",
+            "color": 0,
+            "hoist": False,
+            "position": i,
+            "permissions": "0",
+            "managed": False,
+            "mentionable": False,
+        }
+        for i in range(ROLES)
+    ]
+    members = [
+        {
+            "user": {
+                "id": str(GUILD_ID + 10_000 + i),
+                "username": f"user {i}",
+                "discriminator": "0001",
+                "avatar": None,
+            },
+            "roles": [roles[i % ROLES]["id"]],
+            "joined_at": now,
+            "deaf": False,
+            "mute": False,
+        }
+        for i in range(MEMBERS)
+    ]
+    return {
+        "id": str(GUILD_ID),
+        "name": "benchmark",
+        "icon": None,
+        "splash": None,
+        "discovery_splash": None,
+        "owner_id": members[0]["user"]["id"],
+        "afk_channel_id": None,
+        "afk_timeout": 300,
+        "verification_level": 0,
+        "default_message_notifications": 0,
+        "explicit_content_filter": 0,
+        "roles": roles,
+        "emojis": [
+            {
+                "id": str(GUILD_ID + 1000 + i),
+                "name": f"emoji{i}",
+                "roles": [],
+                "require_colons": True,
+                "managed": False,
+                "animated": False,
+                "available": True,
+            }
+            for i in range(EMOJIS)
+        ],
+        "features": [],
+        "mfa_level": 0,
+        "application_id": None,
+        "system_channel_id": None,
+        "system_channel_flags": 0,
+        "rules_channel_id": None,
+        "joined_at": now,
+        "large": False,
+        "unavailable": False,
+        "member_count": MEMBERS,
+        "voice_states": [],
+        "members": members,
+        "channels": [
+            {
+                "id": str(GUILD_ID + 2000 + i),
+                "type": 0,
+                "name": f"channel-{i}",
+                "position": i,
+                "permission_overwrites": [],
+                "nsfw": False,
+                "parent_id": None,
+                "topic": None,
+                "last_message_id": None,
+                "rate_limit_per_user": 0,
+            }
+            for i in range(CHANNELS)
+        ],
+        "threads": [],
+        "presences": [
+            {"user": member["user"], "status": "online", "activities": [], "client_status": {"desktop": "online"}}
+            for member in members
+        ],
+        "max_members": 500_000,
+        "vanity_url_code": None,
+        "description": None,
+        "banner": None,
+        "premium_tier": 0,
+        "premium_subscription_count": 0,
+        "preferred_locale": "en-US",
+        "public_updates_channel_id": None,
+        "nsfw_level": 0,
+        "stage_instances": [],
+        "stickers": [],
+    }
+
+
+def _rss() -> int:
+    # the current resident set where /proc has it, getrusage only knows the peak
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def measure(name: str) -> None:
+    profile = CONFIGURATIONS[name]
+    if profile is None:
+        bot = hikari.GatewayBot("benchmark", banner=None, intents=hikari.Intents.ALL)
+    else:
+        bot = hikari.GatewayBot(
+            "benchmark", banner=None, intents=profile.intents, cache_settings=profile.cache_settings
+        )
+
+    payload = guild_create()
+    gc.collect()
+    # the payload stays alive until the end, so only what the cache keeps of it is counted,
+    # C buffers included, but memory freed while parsing isn't always given back to the OS
+    before = _rss()
+    bot.event_manager.consume_raw_event("GUILD_CREATE", _Shard(), payload)  # type: ignore[arg-type]
+    # the event is consumed in a task
+    await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not asyncio.current_task()))
+    gc.collect()
+    retained = _rss() - before
+    guilds = len(bot.cache.get_guilds_view())
+    print(f"{name:12} {retained / 1024 / 1024:8.1f} MiB  ({guilds} guild cached)")
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        asyncio.run(measure(sys.argv[1]))
+        return
+
+    # every configuration gets a fresh process, so they don't share freed memory
+    print(f"Resident memory gained with one GUILD_CREATE of {MEMBERS} members, Redis memory not included")
+    for name in CONFIGURATIONS:
+        subprocess.run([sys.executable, "-m", "benchmarks.cache_memory", name], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# run from the repository root with `python -m benchmarks.duration`
+from __future__ import annotations
+
+import datetime
+import timeit
+
+from kangakari.utils import helpers
+
+INPUTS = ["10m", "1h30m", "2 days, 3 hours", "1y 2mo 3w 4d 5h 6m 7s", "13:00", "2030-01-31 08:30"]
+NOW = datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+NUMBER = 100_000
+
+
+def main() -> None:
+    uncached = helpers._parse.__wrapped__  # type: ignore[attr-defined]
+    for text in INPUTS:
+        cold = timeit.timeit(lambda: uncached(text), number=NUMBER)
+        warm = timeit.timeit(lambda: helpers.parse_duration(text, NOW), number=NUMBER)
+        print(f"{text!r:28} uncached {cold / NUMBER * 1e6:6.2f}µs  parse_duration {warm / NUMBER * 1e6:6.2f}µs")
+    print(helpers._parse.cache_info())
+
+
+if __name__ == "__main__":
+    main()
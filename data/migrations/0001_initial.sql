@@ -0,0 +1,58 @@
+create EXTENSION IF NOT EXISTS "uuid-ossp";
+create TABLE IF NOT EXISTS error_groups (
+  fingerprint TEXT PRIMARY KEY,
+  message TEXT NOT NULL,
+  occurrences BIGINT NOT NULL DEFAULT 0,
+  first_seen TIMESTAMPTZ NOT NULL,
+  last_seen TIMESTAMPTZ NOT NULL
+);
+create INDEX IF NOT EXISTS error_groups_last_seen_idx ON error_groups (last_seen);
+DO $$
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('errors')) = 'r' THEN
+    ALTER TABLE errors RENAME TO errors_legacy;
+  END IF;
+END $$;
+create TABLE IF NOT EXISTS errors (
+  error_id UUID NOT NULL,
+  fingerprint TEXT NOT NULL,
+  timestamp TIMESTAMPTZ NOT NULL
+) PARTITION BY RANGE (timestamp);
+create INDEX IF NOT EXISTS errors_error_id_idx ON errors (error_id);
+create OR REPLACE FUNCTION errors_ensure_partition(ts TIMESTAMPTZ) RETURNS VOID AS $$
+DECLARE
+  month_start TIMESTAMP := date_trunc('month', ts AT TIME ZONE 'UTC');
+BEGIN
+  EXECUTE format(
+    'CREATE TABLE IF NOT EXISTS %I PARTITION OF errors FOR VALUES FROM (%L) TO (%L)',
+    'errors_p' || to_char(month_start, 'YYYYMM'),
+    month_start AT TIME ZONE 'UTC',
+    (month_start + interval '1 month') AT TIME ZONE 'UTC'
+  );
+END;
+$$ LANGUAGE plpgsql;
+select errors_ensure_partition(now());
+DO $$
+BEGIN
+  IF to_regclass('errors_legacy') IS NOT NULL THEN
+    UPDATE errors_legacy SET timestamp = now() AT TIME ZONE 'UTC' WHERE timestamp IS NULL;
+    PERFORM errors_ensure_partition(m) FROM (
+      SELECT DISTINCT date_trunc('month', timestamp) AT TIME ZONE 'UTC' AS m FROM errors_legacy
+    ) months;
+    INSERT INTO error_groups (fingerprint, message, occurrences, first_seen, last_seen)
+      SELECT md5(message), min(message), count(*), min(timestamp) AT TIME ZONE 'UTC', max(timestamp) AT TIME ZONE 'UTC'
+      FROM errors_legacy GROUP BY md5(message)
+      ON CONFLICT (fingerprint) DO NOTHING;
+    INSERT INTO errors (error_id, fingerprint, timestamp)
+      SELECT error_id, md5(message), timestamp AT TIME ZONE 'UTC' FROM errors_legacy;
+    DROP TABLE errors_legacy;
+  END IF;
+END $$;
+create TABLE IF NOT EXISTS reminders (
+  reminder_id BIGSERIAL PRIMARY KEY,
+  channel_id BIGINT NOT NULL,
+  user_id BIGINT NOT NULL,
+  text TEXT,
+  due_at TIMESTAMPTZ NOT NULL
+);
+create INDEX IF NOT EXISTS reminders_due_at_idx ON reminders (due_at, reminder_id);
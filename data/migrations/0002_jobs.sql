@@ -0,0 +1,24 @@
+create TABLE IF NOT EXISTS jobs (
+  job_id BIGSERIAL PRIMARY KEY,
+  kind TEXT NOT NULL,
+  payload JSONB NOT NULL DEFAULT '{}',
+  run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  -- repeating jobs run again this long after they were claimed
+  repeat_every INTERVAL,
+  -- repeating jobs are enqueued by every process on startup, they should exist once
+  unique_key TEXT UNIQUE,
+  leased_by TEXT,
+  leased_until TIMESTAMPTZ
+);
+create INDEX IF NOT EXISTS jobs_run_at_idx ON jobs (run_at, job_id);
+create OR REPLACE FUNCTION jobs_notify() RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('kangakari_jobs', NEW.job_id::TEXT);
+  RETURN NEW;
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS jobs_notify ON jobs;
+create TRIGGER jobs_notify AFTER INSERT OR UPDATE OF run_at ON jobs FOR EACH ROW EXECUTE FUNCTION jobs_notify();
+INSERT INTO jobs (kind, payload, run_at)
+  SELECT 'reminder', jsonb_build_object('channel_id', channel_id, 'user_id', user_id, 'text', text), due_at
+  FROM reminders;
+DROP TABLE reminders;
@@ -0,0 +1,11 @@
+-- the next due job is the earliest unleased run_at or the earliest lease to run out, both are index lookups
+create INDEX IF NOT EXISTS jobs_unleased_run_at_idx ON jobs (run_at) WHERE leased_until IS NULL;
+create INDEX IF NOT EXISTS jobs_leased_until_idx ON jobs (leased_until) WHERE leased_until IS NOT NULL;
+-- every process polls at least once a minute (JobQueue.max_sleep), later jobs don't need to wake them up
+create OR REPLACE FUNCTION jobs_notify() RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.run_at <= now() + interval '60 seconds' THEN
+    PERFORM pg_notify('kangakari_jobs', NEW.job_id::TEXT);
+  END IF;
+  RETURN NEW;
+END $$ LANGUAGE plpgsql;
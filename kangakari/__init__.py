@@ -1,6 +1,9 @@
 __version__ = "0.1.0"
 
+# imported first so the startup timer also covers the other imports
+from .utils.timing import STARTUP  # isort: skip
 from .config import Config
 from .database import Database
+from .database import QueryStats
 
-__all__ = ["Database", "Config"]
+__all__ = ["Database", "Config", "QueryStats", "STARTUP"]
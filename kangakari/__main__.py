@@ -1,8 +1,8 @@
-from kangakari import bot
+from kangakari import launcher
 
 
 def main() -> None:
-    bot.run()
+    launcher.main()
 
 
 if __name__ == "__main__":
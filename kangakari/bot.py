@@ -1,88 +1,126 @@
 from __future__ import annotations
 
+import asyncio
+import datetime
+import json
 import logging
-import traceback
+import signal
+import time
+import typing as t
+from pathlib import Path
 
 import hikari
 import lightbulb
 import msgpack
-import sake
 from aiohttp import ClientSession
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from kangakari import STARTUP
 from kangakari import Config
 from kangakari import Database
+from kangakari import QueryStats
+from kangakari.cache import CacheProfile
+from kangakari.cache import EntityCache
+from kangakari.errors import ErrorRecorder
+from kangakari.indexes import GuildStatsIndex
+from kangakari.indexes import RoleIndex
+from kangakari.indexes import VoiceStateIndex
+from kangakari.jobs import JobQueue
+from kangakari.metrics import Metrics
+from kangakari.metrics import MetricsServer
+from kangakari.metrics import bot_collector
+from kangakari.reminders import Reminders
+from kangakari.utils.logs import setup_logging
 
 log = logging.getLogger(__name__)
 
+STARTUP.record("imports", STARTUP.created)
 
-bot = lightbulb.BotApp(
-    Config.TOKEN,
-    ignore_bots=True,
-    owner_ids=Config.OWNER_IDS,
-    default_enabled_guilds=Config.TEST_GUILD_ID,  # this is temporary
-    case_insensitive_prefix_commands=True,
-    intents=hikari.Intents.ALL,
-)
 
-fh = logging.FileHandler("./data/logs/bot.log")
-fh.setFormatter(logging.Formatter("%(levelname)-1.1s %(asctime)23.23s %(name)s: %(message)s"))
-fh.setLevel(logging.DEBUG)
-logging.root.addHandler(fh)
+def _bot(event: hikari.Event) -> lightbulb.BotApp:
+    return t.cast(lightbulb.BotApp, event.app)
 
 
-bot.d.scheduler = AsyncIOScheduler()
-bot.d.db = Database(Config.POSTGRES_DSN)
-bot.d.redis_cache = sake.RedisCache(
-    app=bot,
-    event_manager=bot.event_manager,
-    address=Config.REDIS_ADDRESS,
-    password=Config.REDIS_PASSWORD,
-    event_managed=True,
-    dumps=msgpack.dumps,
-    loads=msgpack.loads,
-)
+async def on_starting(event: hikari.StartingEvent) -> None:
+    bot = _bot(event)
+    if hasattr(signal, "SIGHUP"):
+        # the loop only keeps weak references to tasks
+        reloads: set[asyncio.Task[None]] = set()
 
+        def reload_config() -> None:
+            task = asyncio.create_task(Config.reload())
+            reloads.add(task)
+            task.add_done_callback(reloads.discard)
 
-bot.load_extensions_from("./kangakari/extensions")
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_config)
 
-
-@bot.listen(hikari.StartingEvent)
-async def on_starting(_: hikari.StartingEvent) -> None:
-    bot.d.scheduler.start()
     bot.d.session = ClientSession()
     log.info("AIOHTTP session created")
 
-    await bot.d.db.connect()
-    await bot.d.redis_cache.open()
+    bot.d.metrics.start()
+    if bot.d.metrics_server is not None:
+        await bot.d.metrics_server.start()
+
+    await asyncio.gather(
+        STARTUP.run("db_connect", bot.d.db.connect()),
+        STARTUP.run("redis_open", bot.d.redis_cache.open()),
+    )
+    # migrations run while the shards connect, the schema is only needed once the bot has started
+    bot.d.migrations = asyncio.create_task(STARTUP.run("migrations", bot.d.db.migrate()))
+    bot.d.gateway_start = time.perf_counter()
+
+
+async def on_shard_ready(event: hikari.ShardReadyEvent) -> None:
+    if "first_ready" not in STARTUP.phases:
+        STARTUP.record("first_ready", _bot(event).d.gateway_start)
 
 
-@bot.listen(hikari.StartedEvent)
-async def on_started(_: hikari.StartedEvent) -> None:
-    await bot.d.db.build()
+async def on_started(event: hikari.StartedEvent) -> None:
+    bot = _bot(event)
+    bot.d.command_sync_start = time.perf_counter()
+    await bot.d.migrations
+    bot.d.errors.start()
+    # every process enqueues it, the unique key keeps it at one job
+    await bot.d.jobs.enqueue("errors.maintain", repeat_every=datetime.timedelta(days=1), unique_key="errors.maintain")
+    await bot.d.jobs.start()
 
 
-@bot.listen(hikari.StoppingEvent)
-async def on_stopping(_: hikari.StoppingEvent) -> None:
+async def on_lightbulb_started(event: lightbulb.LightbulbStartedEvent) -> None:
+    STARTUP.record("command_sync", event.app.d.command_sync_start)
+    log.info("Startup report: %s", json.dumps(STARTUP.report()))
+
+
+async def on_stopping(event: hikari.StoppingEvent) -> None:
+    bot = _bot(event)
+    if bot.d.metrics_server is not None:
+        await bot.d.metrics_server.stop()
+    await bot.d.metrics.stop()
+    await bot.d.jobs.stop()
+    await bot.d.errors.stop()
     await bot.d.db.close()
     await bot.d.session.close()
     log.info("AIOHTTP session closed")
-    bot.d.scheduler.shutdown()
 
 
-@bot.listen(lightbulb.CommandErrorEvent)
+async def on_command_invocation(event: lightbulb.events.CommandInvocationEvent) -> None:
+    event.app.d.metrics.command_started(event.context)
+
+
+async def on_command_completion(event: lightbulb.events.CommandCompletionEvent) -> None:
+    event.app.d.metrics.command_finished(event.context, event.command.qualname, "ok")
+
+
 async def on_command_error(e: lightbulb.CommandErrorEvent) -> None:
     # exc = getattr(e.exception, "__cause__", e.exception)
     exc_info = e.exc_info
+    command = e.context.command.qualname if e.context.command is not None else "unknown"
+    e.app.d.metrics.command_finished(e.context, command, "error")
+    e.app.d.metrics.command_failed(command, e.exception)
 
     # handle errors
 
-    log.error("An unhandled exception occurred executing a command (%s)", e.context.command.name, exc_info=exc_info)
+    log.error("An unhandled exception occurred executing a command (%s)", command, exc_info=exc_info)
 
-    error_id = await bot.d.db.fetch_val(
-        "INSERT INTO errors (message) VALUES ($1) RETURNING error_id",
-        "".join(traceback.format_exception(*exc_info)),
-    )
+    error_id = e.app.d.errors.record(exc_info)
 
     await e.context.respond(
         f"An error occurred. Please contact {' | '.join(f'<@{owner_id}>' for owner_id in Config.OWNER_IDS)}"
@@ -90,13 +128,108 @@ async def on_command_error(e: lightbulb.CommandErrorEvent) -> None:
     )
 
 
-def run() -> None:
+def build_bot(
+    shard_ids: t.Sequence[int] | None = None, shard_count: int | None = None, worker: int | None = None
+) -> lightbulb.BotApp:
+    # every process builds its own bot, with its own loop, pools and clients, Redis is what they share
+    cache_profile = CacheProfile.parse(Config.CACHE_PROFILE)
+
+    bot = lightbulb.BotApp(
+        Config.TOKEN,
+        ignore_bots=True,
+        owner_ids=Config.OWNER_IDS,
+        default_enabled_guilds=Config.TEST_GUILD_ID,  # this is temporary
+        case_insensitive_prefix_commands=True,
+        intents=cache_profile.intents,
+        cache_settings=cache_profile.cache_settings,
+    )
+    bot.d.shard_ids = shard_ids
+    bot.d.shard_count = shard_count
+
+    bot.d.db = Database(
+        Config.POSTGRES_DSN,
+        min_size=Config.POSTGRES_POOL_MIN,
+        max_size=Config.POSTGRES_POOL_MAX,
+        max_idle=Config.POSTGRES_POOL_MAX_IDLE,
+        statement_cache_size=Config.POSTGRES_STATEMENT_CACHE_SIZE,
+        stats=QueryStats(Config.DB_SLOW_QUERY_MS / 1000) if Config.DB_STATS else None,
+    )
+    bot.d.jobs = JobQueue(bot.d.db)
+    bot.d.reminders = Reminders(bot.rest, bot.d.jobs)
+    bot.d.errors = ErrorRecorder(
+        bot.d.db,
+        max_pending=Config.ERROR_BUFFER_SIZE,
+        interval=Config.ERROR_FLUSH_INTERVAL,
+        retention=datetime.timedelta(days=Config.ERROR_RETENTION_DAYS),
+    )
+    bot.d.jobs.register("errors.maintain", lambda _: bot.d.errors.maintain())
+    bot.d.redis_cache = cache_profile.redis_cache_class()(
+        app=bot,
+        event_manager=bot.event_manager,
+        address=Config.REDIS_ADDRESS,
+        password=Config.REDIS_PASSWORD,
+        event_managed=True,
+        dumps=msgpack.dumps,
+        loads=msgpack.loads,
+    )
+    bot.d.cache = EntityCache(bot, bot.d.redis_cache, cache_profile, Config.CACHE_MAX_BYTES)
+    bot.d.cache.subscribe(bot.event_manager)
+    bot.d.guild_stats = GuildStatsIndex()
+    bot.d.guild_stats.subscribe(bot.event_manager)
+    bot.d.role_index = RoleIndex()
+    bot.d.role_index.subscribe(bot.event_manager)
+    bot.d.voice_states = VoiceStateIndex()
+    bot.d.voice_states.subscribe(bot.event_manager)
+    bot.d.metrics = Metrics()
+    bot.d.metrics.add_collector(bot_collector(bot))
+    bot.d.metrics_server = None
+    if Config.METRICS_PORT is not None:
+        bot.d.metrics_server = MetricsServer(bot.d.metrics, Config.METRICS_HOST, Config.METRICS_PORT + (worker or 0))
+
+    bot.subscribe(hikari.StartingEvent, on_starting)
+    bot.subscribe(hikari.ShardReadyEvent, on_shard_ready)
+    bot.subscribe(hikari.StartedEvent, on_started)
+    bot.subscribe(lightbulb.LightbulbStartedEvent, on_lightbulb_started)
+    bot.subscribe(hikari.StoppingEvent, on_stopping)
+    bot.subscribe(lightbulb.events.CommandInvocationEvent, on_command_invocation)
+    bot.subscribe(lightbulb.events.CommandCompletionEvent, on_command_completion)
+    bot.subscribe(lightbulb.CommandErrorEvent, on_command_error)
+
+    with STARTUP.phase("extensions"):
+        bot.load_extensions_from("./kangakari/extensions")
+
+    return bot
+
+
+def run(shard_ids: t.Sequence[int] | None = None, shard_count: int | None = None, worker: int | None = None) -> None:
+    # hikari only sets up console logging when the root logger has no handlers yet, so the bot is built first
+    bot = build_bot(shard_ids, shard_count, worker)
+    # rotating one file from several processes loses records, so every worker gets its own
+    path = Path(Config.LOG_PATH)
+    if worker is not None:
+        path = path.with_name(f"{path.stem}-{worker}{path.suffix}")
+    listener = setup_logging(
+        str(path),
+        max_bytes=Config.LOG_MAX_BYTES,
+        rotate_when=Config.LOG_ROTATE_WHEN,
+        backup_count=Config.LOG_BACKUP_COUNT,
+        json_lines=Config.LOG_JSON,
+        queue_size=Config.LOG_QUEUE_SIZE,
+    )
     # lavasnek_rs doesn't work with uvloop
     # if os.name != "nt":
     #    import uvloop
     #
     #    uvloop.install()
-    bot.run(asyncio_debug=True)
-
-
-__all__ = ["run"]
+    shards: dict[str, t.Any] = {}
+    if shard_count is not None:
+        shards["shard_count"] = shard_count
+    if shard_ids is not None:
+        shards["shard_ids"] = set(shard_ids)
+    try:
+        bot.run(asyncio_debug=True, **shards)
+    finally:
+        listener.stop()
+
+
+__all__ = ["build_bot", "run"]
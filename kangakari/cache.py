@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import typing as t
+from collections import OrderedDict
+
+import hikari
+import sake
+
+log = logging.getLogger(__name__)
+
+T = t.TypeVar("T")
+Key = tuple[t.Any, ...]
+Store = t.Literal["memory", "redis", "none"]
+
+
+class Resource(t.NamedTuple):
+    component: hikari.CacheComponents
+    redis: tuple[type[sake.redis.ResourceClient], ...]
+    intents: hikari.Intents
+
+
+RESOURCES = {
+    "guilds": Resource(hikari.CacheComponents.GUILDS, (sake.redis.GuildCache,), hikari.Intents.GUILDS),
+    "channels": Resource(hikari.CacheComponents.GUILD_CHANNELS, (sake.redis.GuildChannelCache,), hikari.Intents.GUILDS),
+    "roles": Resource(hikari.CacheComponents.ROLES, (sake.redis.RoleCache,), hikari.Intents.GUILDS),
+    "members": Resource(
+        hikari.CacheComponents.MEMBERS, (sake.redis.MemberCache, sake.redis.UserCache), hikari.Intents.GUILD_MEMBERS
+    ),
+    "emojis": Resource(hikari.CacheComponents.EMOJIS, (sake.redis.EmojiCache,), hikari.Intents.GUILD_EMOJIS),
+    "presences": Resource(
+        hikari.CacheComponents.PRESENCES, (sake.redis.PresenceCache,), hikari.Intents.GUILD_PRESENCES
+    ),
+    "voice_states": Resource(
+        hikari.CacheComponents.VOICE_STATES, (sake.redis.VoiceStateCache,), hikari.Intents.GUILD_VOICE_STATES
+    ),
+    "messages": Resource(
+        hikari.CacheComponents.MESSAGES,
+        (sake.redis.MessageCache,),
+        hikari.Intents.GUILD_MESSAGES | hikari.Intents.DM_MESSAGES,
+    ),
+    "invites": Resource(hikari.CacheComponents.INVITES, (sake.redis.InviteCache,), hikari.Intents.GUILD_INVITES),
+}
+# the indexes need members and the music plugin needs voice states, whatever is cached
+BASE_INTENTS = hikari.Intents.GUILDS | hikari.Intents.GUILD_MEMBERS | hikari.Intents.GUILD_VOICE_STATES
+# permission checks and guild.get_roles/get_emojis read the in-memory cache, the big resources live in Redis
+DEFAULT_PROFILE: dict[str, Store] = {
+    "guilds": "memory",
+    "channels": "memory",
+    "roles": "memory",
+    "members": "redis",
+    "emojis": "memory",
+    "presences": "none",
+    "voice_states": "none",
+    "messages": "none",
+    "invites": "none",
+}
+
+
+class CacheProfile:
+    def __init__(self, stores: t.Mapping[str, Store]):
+        for name, store in stores.items():
+            if name not in RESOURCES:
+                raise ValueError(f"Unknown cache resource {name!r}")
+            if store not in ("memory", "redis", "none"):
+                raise ValueError(f"{name} should be cached in memory, redis or none, not {store!r}")
+        self.stores: dict[str, Store] = {**DEFAULT_PROFILE, **stores}
+
+    @classmethod
+    def parse(cls, entries: list[str] | None) -> CacheProfile:
+        # entries look like "members=redis"
+        stores: dict[str, t.Any] = {}
+        for entry in entries or ():
+            name, _, store = entry.partition("=")
+            stores[name.strip()] = store.strip()
+        return cls(stores)
+
+    def _with(self, store: Store) -> list[Resource]:
+        return [RESOURCES[name] for name, s in self.stores.items() if s == store]
+
+    @property
+    def intents(self) -> hikari.Intents:
+        intents = BASE_INTENTS
+        for name, store in self.stores.items():
+            if store != "none":
+                intents |= RESOURCES[name].intents
+        return intents
+
+    @property
+    def cache_settings(self) -> hikari.CacheSettings:
+        # the bot's own user is always kept, whatever the components
+        components = hikari.CacheComponents.NONE
+        for resource in self._with("memory"):
+            components |= resource.component
+        return hikari.CacheSettings(components=components)
+
+    def redis_cache_class(self) -> type[sake.redis.ResourceClient]:
+        # the user database is always there, the lavalink module keeps its own keys in it
+        bases: dict[type[sake.redis.ResourceClient], None] = {}
+        for resource in self._with("redis"):
+            bases.update(dict.fromkeys(resource.redis))
+        bases.setdefault(sake.redis.UserCache)
+        return type("KangakariRedisCache", tuple(bases), {})
+
+
+def estimate_size(obj: t.Any, depth: int = 4, _seen: set[int] | None = None) -> int:
+    # good enough to weigh entries against each other, hikari entities are attrs classes with slots
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen or depth < 0:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return size
+
+    if isinstance(obj, t.Mapping):
+        children: t.Iterable[t.Any] = (*obj.keys(), *obj.values())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        children = obj
+    else:
+        names = getattr(type(obj), "__slots__", ())
+        children = [getattr(obj, name, None) for name in ([names] if isinstance(names, str) else names)]
+        children.extend(getattr(obj, "__dict__", {}).values())
+        # the app is shared by every entity
+        children = [child for child in children if not isinstance(child, hikari.traits.RESTAware)]
+    return size + sum(estimate_size(child, depth - 1, seen) for child in children)
+
+
+class CacheStats:
+    __slots__ = ("hits", "misses", "evictions")
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class EntityCache:
+    # one read path for commands, wherever the profile keeps a resource
+    # Redis reads go through an in-process LRU, bounded by the estimated size of the entries
+    def __init__(
+        self,
+        app: hikari.GatewayBot,
+        redis_cache: sake.redis.ResourceClient,
+        profile: CacheProfile,
+        max_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.app = app
+        self.redis_cache = redis_cache
+        self.profile = profile
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = {kind: CacheStats() for kind in ("guild", "channel", "role", "member")}
+        self._entries: OrderedDict[Key, tuple[int, t.Any]] = OrderedDict()
+        self._pending: dict[Key, asyncio.Task[t.Any]] = {}
+        # Redis reads that raced with an event, their result is returned but not stored
+        self._stale: set[Key] = set()
+
+    async def get_guild(self, guild_id: hikari.Snowflakeish) -> hikari.GatewayGuild:
+        key = ("guild", hikari.Snowflake(guild_id))
+        return t.cast(hikari.GatewayGuild, await self._get("guilds", key, "get_guild", guild_id))
+
+    async def get_guild_channel(self, channel_id: hikari.Snowflakeish) -> hikari.GuildChannel:
+        key = ("channel", hikari.Snowflake(channel_id))
+        return t.cast(hikari.GuildChannel, await self._get("channels", key, "get_guild_channel", channel_id))
+
+    async def get_role(self, role_id: hikari.Snowflakeish) -> hikari.Role:
+        key = ("role", hikari.Snowflake(role_id))
+        return t.cast(hikari.Role, await self._get("roles", key, "get_role", role_id))
+
+    async def get_member(self, guild_id: hikari.Snowflakeish, user_id: hikari.Snowflakeish) -> hikari.Member:
+        key = ("member", hikari.Snowflake(guild_id), hikari.Snowflake(user_id))
+        return t.cast(hikari.Member, await self._get("members", key, "get_member", guild_id, user_id))
+
+    async def _get(self, resource: str, key: Key, method: str, *args: t.Any) -> t.Any:
+        # the in-memory cache and sake share their getter names
+        store = self.profile.stores[resource]
+        if store == "memory":
+            if (value := getattr(self.app.cache, method)(*args)) is None:
+                raise sake.errors.EntryNotFound(f"{key[0].title()} not found")
+            return value
+        if store == "none":
+            raise sake.errors.EntryNotFound(f"{resource.title()} are not cached")
+
+        stats = self.stats[key[0]]
+        if (entry := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+            stats.hits += 1
+            return entry[1]
+
+        stats.misses += 1
+        # concurrent misses for the same entity share one read
+        if (task := self._pending.get(key)) is None:
+            fetch = getattr(self.redis_cache, method)
+            task = self._pending[key] = asyncio.create_task(self._fetch(key, fetch, *args))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Key, fetch: t.Callable[..., t.Awaitable[T]], *args: t.Any) -> T:
+        try:
+            value = await fetch(*args)
+        finally:
+            stale = key in self._stale
+            self._stale.discard(key)
+        if not stale:
+            self._store(key, value)
+        return value
+
+    def _store(self, key: Key, value: t.Any) -> None:
+        self._discard(key)
+        weight = estimate_size(value)
+        if weight > self.max_bytes:
+            return
+        self._entries[key] = (weight, value)
+        self.size += weight
+        while self.size > self.max_bytes:
+            evicted, (evicted_weight, _) = self._entries.popitem(last=False)
+            self.size -= evicted_weight
+            self.stats[evicted[0]].evictions += 1
+
+    def _discard(self, key: Key) -> None:
+        if (entry := self._entries.pop(key, None)) is not None:
+            self.size -= entry[0]
+
+    def _invalidate(self, key: Key, value: t.Any = None) -> None:
+        # updates carry the new entity, so it replaces the old one instead of costing a miss later
+        if key in self._pending:
+            self._stale.add(key)
+        if value is not None and key in self._entries:
+            self._store(key, value)
+        else:
+            self._discard(key)
+
+    def _invalidate_guild(self, guild_id: hikari.Snowflake) -> None:
+        self._invalidate(("guild", guild_id))
+        for key, (_, value) in list(self._entries.items()):
+            if getattr(value, "guild_id", None) == guild_id:
+                self._invalidate(key)
+
+    def subscribe(self, event_manager: hikari.api.EventManager) -> None:
+        event_manager.subscribe(hikari.GuildAvailableEvent, self._on_guild_reset)
+        event_manager.subscribe(hikari.GuildUnavailableEvent, self._on_guild_reset)
+        event_manager.subscribe(hikari.GuildLeaveEvent, self._on_guild_reset)
+        event_manager.subscribe(hikari.GuildUpdateEvent, self._on_guild_update)
+        event_manager.subscribe(hikari.GuildChannelUpdateEvent, self._on_channel_update)
+        event_manager.subscribe(hikari.GuildChannelDeleteEvent, self._on_channel_delete)
+        event_manager.subscribe(hikari.RoleUpdateEvent, self._on_role_update)
+        event_manager.subscribe(hikari.RoleDeleteEvent, self._on_role_delete)
+        event_manager.subscribe(hikari.MemberUpdateEvent, self._on_member_update)
+        event_manager.subscribe(hikari.MemberDeleteEvent, self._on_member_delete)
+
+    async def _on_guild_reset(
+        self, event: hikari.GuildAvailableEvent | hikari.GuildUnavailableEvent | hikari.GuildLeaveEvent
+    ) -> None:
+        self._invalidate_guild(event.guild_id)
+
+    async def _on_guild_update(self, event: hikari.GuildUpdateEvent) -> None:
+        self._invalidate(("guild", event.guild_id), event.guild)
+
+    async def _on_channel_update(self, event: hikari.GuildChannelUpdateEvent) -> None:
+        self._invalidate(("channel", event.channel.id), event.channel)
+
+    async def _on_channel_delete(self, event: hikari.GuildChannelDeleteEvent) -> None:
+        self._invalidate(("channel", event.channel.id))
+
+    async def _on_role_update(self, event: hikari.RoleUpdateEvent) -> None:
+        self._invalidate(("role", event.role_id), event.role)
+
+    async def _on_role_delete(self, event: hikari.RoleDeleteEvent) -> None:
+        self._invalidate(("role", event.role_id))
+
+    async def _on_member_update(self, event: hikari.MemberUpdateEvent) -> None:
+        self._invalidate(("member", event.guild_id, event.user.id), event.member)
+
+    async def _on_member_delete(self, event: hikari.MemberDeleteEvent) -> None:
+        self._invalidate(("member", event.guild_id, event.user.id))
+
+
+__all__ = ["CacheProfile", "CacheStats", "DEFAULT_PROFILE", "EntityCache", "RESOURCES", "estimate_size"]
@@ -1,31 +1,157 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 import typing as t
-from functools import lru_cache
 from os import environ
 from pathlib import Path
 
 from dotenv import load_dotenv
 
-load_dotenv()
+log = logging.getLogger(__name__)
+
+_MISSING: t.Any = object()
+
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+_PARSERS: dict[str, t.Callable[[str], t.Any]] = {
+    "bool": _parse_bool,
+    "int": int,
+    "float": float,
+    "file": lambda x: Path(x).read_text().strip("\n"),
+    "str": str,
+}
+_TYPES: dict[str, type | tuple[type, ...]] = {"bool": bool, "int": int, "float": (int, float), "str": str, "list": list}
+
+
+def resolve_value(value: str, kind: str = "str", item: str = "str") -> t.Any:
+    # values can still be prefixed with their type, e.g. "int:5" or "file:/run/secrets/token"
+    prefix, sep, rest = value.partition(":")
+    if sep and (prefix in _PARSERS or prefix == "list"):
+        kind, value = prefix, rest
+    if kind == "list":
+        return [resolve_value(x, item) for x in value.split(",")]
+    return _PARSERS[kind](value)
+
+
+class Setting(t.NamedTuple):
+    kind: str
+    default: t.Any = _MISSING
+    # the kind of the items of a list
+    item: str = "str"
+
+
+SCHEMA: dict[str, Setting] = {
+    "TOKEN": Setting("str"),
+    # the recommended shard count and one process per core when unset
+    "SHARD_COUNT": Setting("int", None),
+    "WORKER_PROCESSES": Setting("int", None),
+    "OWNER_IDS": Setting("list", item="int"),
+    "TEST_GUILD_ID": Setting("list", None, item="int"),
+    "POSTGRES_DSN": Setting("str"),
+    "POSTGRES_POOL_MIN": Setting("int", 2),
+    "POSTGRES_POOL_MAX": Setting("int", 10),
+    "POSTGRES_POOL_MAX_IDLE": Setting("float", 300.0),
+    "POSTGRES_STATEMENT_CACHE_SIZE": Setting("int", 256),
+    "DB_STATS": Setting("bool", False),
+    "DB_SLOW_QUERY_MS": Setting("float", 250.0),
+    "ERROR_BUFFER_SIZE": Setting("int", 1000),
+    "ERROR_FLUSH_INTERVAL": Setting("float", 5.0),
+    "ERROR_RETENTION_DAYS": Setting("int", 90),
+    "REDIS_ADDRESS": Setting("str"),
+    "REDIS_PASSWORD": Setting("str", None),
+    "CACHE_MAX_BYTES": Setting("int", 32 * 1024 * 1024),
+    # entries like "members=redis", resources that aren't listed use the default profile
+    "CACHE_PROFILE": Setting("list", None),
+    "LAVALINK_HOST": Setting("str", None),
+    "LAVALINK_HOSTS": Setting("list", None),
+    "LAVALINK_PASSWORD": Setting("str"),
+    "TRACK_CACHE_SIZE": Setting("int", 512),
+    "TRACK_CACHE_TTL": Setting("float", 600.0),
+    "TRACK_CACHE_REDIS_TTL": Setting("int", 86400),
+    # the metrics server is off without a port, every worker process listens on the port plus its index
+    "METRICS_HOST": Setting("str", "127.0.0.1"),
+    "METRICS_PORT": Setting("int", None),
+    "LOG_PATH": Setting("str", "./data/logs/bot.log"),
+    "LOG_MAX_BYTES": Setting("int", 10 * 1024 * 1024),
+    "LOG_ROTATE_WHEN": Setting("str", None),
+    "LOG_BACKUP_COUNT": Setting("int", 10),
+    "LOG_JSON": Setting("bool", False),
+    "LOG_QUEUE_SIZE": Setting("int", 10_000),
+}
+
+
+class ConfigSnapshot:
+    __slots__ = tuple(SCHEMA)
+
+    def __init__(self, values: dict[str, t.Any]):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: t.Any) -> None:
+        raise AttributeError("Config snapshots are immutable, use Config.reload")
+
+
+def _parse(name: str, setting: Setting) -> t.Any:
+    if (raw := environ.get(name)) is None:
+        if setting.default is _MISSING:
+            raise ValueError(f"{name} is not set")
+        return setting.default
+
+    try:
+        value = resolve_value(raw, setting.kind, setting.item)
+    except (ValueError, OSError) as e:
+        raise ValueError(f"{name} is invalid: {e}") from e
+
+    if setting.kind == "list" and not isinstance(value, list):
+        value = [value]
+    if not isinstance(value, _TYPES[setting.kind]):
+        raise ValueError(f"{name} should be a {setting.kind}, not {type(value).__name__}")
+    return float(t.cast(float, value)) if setting.kind == "float" else value
+
+
+def load_snapshot() -> ConfigSnapshot:
+    load_dotenv(override=True)
+    values = {name: _parse(name, setting) for name, setting in SCHEMA.items()}
+
+    if values["LAVALINK_HOSTS"] is None:
+        if values["LAVALINK_HOST"] is None:
+            raise ValueError("LAVALINK_HOSTS or LAVALINK_HOST is not set")
+        values["LAVALINK_HOSTS"] = [values["LAVALINK_HOST"]]
+
+    return ConfigSnapshot(values)
 
 
 class ConfigMeta(type):
-    def resolve_value(cls, value: str) -> t.Any:
-        _map: dict[str, t.Callable[[str], t.Any]] = {
-            "bool": bool,
-            "int": int,
-            "float": float,
-            "file": lambda x: Path(x).read_text().strip("\n"),
-            "str": str,
-            "list": lambda x: [cls.resolve_value(y) for y in x.split(",")],
-        }
-
-        return _map[(v := value.split(":", maxsplit=1))[0]](v[1])
-
-    @lru_cache()
+    _snapshot: ConfigSnapshot | None = None
+
     def __getattr__(cls, name: str) -> t.Any:
-        return cls.resolve_value(environ[name])
+        # only reached before the config is loaded, after that every setting is a plain class attribute
+        if name in SCHEMA:
+            raise RuntimeError(f"Config.{name} was read before Config.load()")
+        raise AttributeError(name)
+
+    def _apply(cls, snapshot: ConfigSnapshot) -> None:
+        # no awaits in between, so nothing sees half of an old config and half of a new one
+        cls._snapshot = snapshot
+        for name in SCHEMA:
+            setattr(cls, name, getattr(snapshot, name))
+
+    def load(cls) -> None:
+        cls._apply(load_snapshot())
+
+    async def reload(cls) -> None:
+        # .env and secret files are read in a thread
+        try:
+            snapshot = await asyncio.to_thread(load_snapshot)
+        except ValueError:
+            log.exception("Could not reload the config, keeping the old one")
+            return
+        cls._apply(snapshot)
+        log.info("Reloaded config")
 
 
 class Config(metaclass=ConfigMeta):
@@ -1,32 +1,185 @@
 from __future__ import annotations
 
+import hashlib
 import logging
+import math
+import re
+import time
 import typing as t
 from contextlib import asynccontextmanager
+from functools import lru_cache
+from pathlib import Path
 
 import aiofiles
 import asyncpg
 
+from kangakari.utils.stats import Histogram
+
 log = logging.getLogger(__name__)
 
+MIGRATIONS_PATH = Path("./data/migrations")
+# an arbitrary key for the advisory lock, the same in every process
+MIGRATIONS_LOCK = 0x6B616E67
+
+# upper bounds of the rows returned or affected per statement
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000, math.inf)
+
+# numbers, but not the digits of $1 placeholders
+_LITERAL_REGEX = re.compile(r"'(?:[^']|'')*'|(?<!\$)\b\d+(?:\.\d+)?\b")
+_WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(command: str) -> str:
+    return _WHITESPACE_REGEX.sub(" ", _LITERAL_REGEX.sub("?", command)).strip()
+
+
+def _row_count(method: str, args: t.Sequence[t.Any], result: t.Any) -> int:
+    if method == "executemany":
+        return len(args[0])
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, str):
+        # command status, e.g. "INSERT 0 5" or "DELETE 3"
+        count = result.rsplit(" ", 1)[-1]
+        return int(count) if count.isdigit() else 0
+    return 1
+
+
+def _check_migration(applied: dict[int, str], version: int, name: str, checksum: str) -> bool:
+    if version not in applied:
+        return False
+    if applied[version] != checksum:
+        raise RuntimeError(f"Migration {name} was changed after it was applied, add a new migration instead")
+    return True
+
+
+class StatementStats:
+    __slots__ = ("wait", "execution", "rows")
+
+    def __init__(self) -> None:
+        self.wait = Histogram()
+        self.execution = Histogram()
+        self.rows = Histogram(ROW_BUCKETS)
+
+
+class QueryStats:
+    def __init__(self, slow_threshold: float):
+        self.slow_threshold = slow_threshold
+        self.statements: dict[str, StatementStats] = {}
+
+    def record(self, command: str, args: t.Sequence[t.Any], wait: float, execution: float, rows: int) -> None:
+        key = normalize_sql(command)
+        if (stats := self.statements.get(key)) is None:
+            stats = self.statements[key] = StatementStats()
+        stats.wait.observe(wait)
+        stats.execution.observe(execution)
+        stats.rows.observe(rows)
+
+        if execution >= self.slow_threshold:
+            log.warning(
+                "Slow query (%.1f ms, waited %.1f ms for a connection): %s %s",
+                execution * 1000,
+                wait * 1000,
+                key,
+                [f"<{type(arg).__name__}>" for arg in args],
+            )
+
+    def top(self, n: int, by: str = "total") -> list[tuple[str, StatementStats]]:
+        def key(item: tuple[str, StatementStats]) -> float:
+            return item[1].execution.quantile(0.99) if by == "p99" else item[1].execution.sum
+
+        return sorted(self.statements.items(), key=key, reverse=True)[:n]
+
+    def reset(self) -> None:
+        self.statements.clear()
+
+
+class _Queries:
+    # the query methods of the pool and of the connections `Database.transaction` hands out
+
+    async def _query(self, method: str, command: str, args: t.Sequence[t.Any], **kwargs: t.Any) -> t.Any:
+        raise NotImplementedError
+
+    async def execute(self, command: str, *args: t.Any) -> None:
+        await self._query("execute", command, args)
+
+    async def execute_many(self, command: str, args: list[t.Any]) -> None:
+        # executemany is atomic on its own
+        await self._query("executemany", command, (args,))
+
+    async def copy_records(self, table: str, records: t.Iterable[t.Sequence[t.Any]], columns: t.Sequence[str]) -> None:
+        await self._query("copy_records_to_table", table, (), records=records, columns=columns)
+
+    async def fetch_val(self, command: str, *args: t.Any, column: int = 0) -> t.Any:
+        return await self._query("fetchval", command, args, column=column)
+
+    async def fetch_column(self, command: str, *args: t.Any, column: int = 0) -> list[t.Any]:
+        return [record[column] for record in await self._query("fetch", command, args)]
+
+    async def fetch_record(self, command: str, *args: t.Any) -> asyncpg.Record:
+        record: asyncpg.Record = await self._query("fetchrow", command, args)
+        return record
+
+    async def fetch_all(self, command: str, *args: t.Any) -> list[asyncpg.Record]:
+        records: list[asyncpg.Record] = await self._query("fetch", command, args)
+        return records
+
 
-@asynccontextmanager
-async def _acquire(pool: asyncpg.Pool) -> asyncpg.Connection:
-    try:
-        async with pool.acquire() as conn:
-            async with conn.transaction():
-                yield conn
-    finally:
-        pass
+class Connection(_Queries):
+    def __init__(self, raw: asyncpg.Connection, stats: QueryStats | None, wait: float = 0.0):
+        self.raw = raw
+        self.stats = stats
+        # the wait for the connection is counted once, on the first statement
+        self._wait = wait
 
+    def transaction(self) -> t.Any:
+        return self.raw.transaction()
 
-class Database:
-    def __init__(self, dsn: str):
+    async def _query(self, method: str, command: str, args: t.Sequence[t.Any], **kwargs: t.Any) -> t.Any:
+        if self.stats is None:
+            return await getattr(self.raw, method)(command, *args, **kwargs)
+
+        start = time.perf_counter()
+        result = await getattr(self.raw, method)(command, *args, **kwargs)
+        self.stats.record(command, args, self._wait, time.perf_counter() - start, _row_count(method, args, result))
+        self._wait = 0.0
+        return result
+
+
+class Database(_Queries):
+    # single statements run in autocommit mode, use `transaction` to group several of them
+
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        min_size: int = 2,
+        max_size: int = 10,
+        max_idle: float = 300.0,
+        statement_cache_size: int = 256,
+        stats: QueryStats | None = None,
+    ):
         self.dsn = dsn
-        self._pool = None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.statement_cache_size = statement_cache_size
+        self.stats = stats
+        self._pool: asyncpg.Pool | None = None
 
     async def connect(self) -> None:
-        self._pool = await asyncpg.create_pool(self.dsn)
+        # asyncpg keeps a per-connection LRU of named prepared statements keyed by the SQL text,
+        # so repeated queries skip the parse/plan round trip
+        self._pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            max_inactive_connection_lifetime=self.max_idle,
+            statement_cache_size=self.statement_cache_size,
+        )
         log.info("Connected to database")
 
     async def close(self) -> None:
@@ -34,34 +187,74 @@ class Database:
         await self._pool.close()
         log.info("Closed database pool")
 
-    async def build(self) -> None:
-        async with aiofiles.open("./data/build.sql") as f:
-            await self.execute((await f.read()))
-        log.info("Built database")
+    @property
+    def pool(self) -> asyncpg.Pool:
+        assert self._pool is not None
+        return self._pool
 
-    async def execute(self, command: str, *args: t.Any) -> None:
-        async with _acquire(self._pool) as conn:
-            await conn.execute(command, *args)
+    @asynccontextmanager
+    async def transaction(self) -> t.AsyncIterator[Connection]:
+        start = time.perf_counter()
+        async with self.pool.acquire() as raw:
+            async with raw.transaction():
+                yield Connection(raw, self.stats, time.perf_counter() - start)
 
-    async def execute_many(self, command: str, args: list[t.Any]) -> None:
-        async with _acquire(self._pool) as conn:
-            await conn.executemany(command, args)
+    async def migrate(self) -> None:
+        migrations = []
+        for path in sorted(MIGRATIONS_PATH.glob("*.sql")):
+            async with aiofiles.open(path) as f:
+                sql = await f.read()
+            checksum = hashlib.sha256(sql.encode()).hexdigest()
+            migrations.append((int(path.name.split("_", 1)[0]), path.stem, sql, checksum))
 
-    async def fetch_val(self, command: str, *args: t.Any, column: int = 0) -> t.Any:
-        async with _acquire(self._pool) as conn:
-            return await conn.fetchval(command, *args, column=column)
+        # nothing to do is the common case, that costs one query and no locks
+        try:
+            applied = dict(await self.fetch_all("SELECT version, checksum FROM schema_migrations"))
+        except asyncpg.UndefinedTableError:
+            applied = {}
+        if all(_check_migration(applied, version, name, checksum) for version, name, _, checksum in migrations):
+            log.info("Database schema is up to date")
+            return
 
-    async def fetch_column(self, command: str, *args: t.Any, column: int = 0) -> list[t.Any]:
-        async with _acquire(self._pool) as conn:
-            return [record[column] for record in await conn.fetch(command, *args)]
+        async with self.pool.acquire() as raw:
+            conn = Connection(raw, self.stats)
+            # other processes starting at the same time wait here and then find nothing left to apply
+            await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK)
+            try:
+                await conn.execute(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "version INTEGER PRIMARY KEY, name TEXT NOT NULL, checksum TEXT NOT NULL, "
+                    "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                )
+                applied = dict(await conn.fetch_all("SELECT version, checksum FROM schema_migrations"))
+                for version, name, sql, checksum in migrations:
+                    if _check_migration(applied, version, name, checksum):
+                        continue
+                    async with conn.transaction():
+                        await conn.execute(sql)
+                        await conn.execute(
+                            "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                            version,
+                            name,
+                            checksum,
+                        )
+                    log.info("Applied migration %s", name)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK)
 
-    async def fetch_record(self, command: str, *args: t.Any) -> asyncpg.Record:
-        async with _acquire(self._pool) as conn:
-            return await conn.fetchrow(command, *args)
+    async def _query(self, method: str, command: str, args: t.Sequence[t.Any], **kwargs: t.Any) -> t.Any:
+        if self.stats is None:
+            async with self.pool.acquire() as conn:
+                return await getattr(conn, method)(command, *args, **kwargs)
 
-    async def fetch_all(self, command: str, *args: t.Any) -> list[asyncpg.Record]:
-        async with _acquire(self._pool) as conn:
-            return await conn.fetch(command, *args)
+        start = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            acquired = time.perf_counter()
+            result = await getattr(conn, method)(command, *args, **kwargs)
+            end = time.perf_counter()
+
+        self.stats.record(command, args, acquired - start, end - acquired, _row_count(method, args, result))
+        return result
 
 
-__all__ = ["Database"]
+__all__ = ["Connection", "Database", "QueryStats", "StatementStats", "normalize_sql"]
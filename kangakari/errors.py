@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import hashlib
+import logging
+import traceback
+import typing as t
+import uuid
+from collections import deque
+
+import asyncpg
+
+if t.TYPE_CHECKING:
+    from types import TracebackType
+
+    from kangakari import Database
+
+    ExcInfo = tuple[type[BaseException], BaseException, TracebackType | None]
+
+log = logging.getLogger(__name__)
+
+
+def fingerprint(exc_info: ExcInfo) -> str:
+    # the exception types and the code of every frame, without messages, addresses or line numbers,
+    # so the same bug always gets the same fingerprint
+    h = hashlib.sha1()
+    exc: traceback.TracebackException | None = traceback.TracebackException(*exc_info)
+    while exc is not None:
+        h.update(f"{exc.exc_type.__module__}.{exc.exc_type.__qualname__}\n".encode() if exc.exc_type else b"\n")
+        for frame in exc.stack:
+            h.update(f"{frame.filename}:{frame.name}:{frame.line}\n".encode())
+        exc = exc.__cause__ or exc.__context__
+    return h.hexdigest()
+
+
+class PendingError(t.NamedTuple):
+    error_id: uuid.UUID
+    fingerprint: str
+    message: str
+    timestamp: datetime.datetime
+
+
+class ErrorRecorder:
+    def __init__(
+        self,
+        db: Database,
+        max_pending: int = 1000,
+        batch_size: int = 100,
+        interval: float = 5.0,
+        retention: datetime.timedelta = datetime.timedelta(days=90),
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = retention
+        # when the buffer is full the oldest errors are dropped, they are still in the log file
+        self._pending: deque[PendingError] = deque(maxlen=max_pending)
+        self._flush_now = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self.dropped = 0
+        self._reported_drops = 0
+        # months the errors partition is known to exist for
+        self._partitions: set[datetime.datetime] = set()
+
+    def start(self) -> None:
+        assert self._task is None
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # not cancelled, a batch that is being written would be lost with it
+        self._closing.set()
+        self._flush_now.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    def record(self, exc_info: ExcInfo) -> uuid.UUID:
+        error = PendingError(
+            uuid.uuid4(),
+            fingerprint(exc_info),
+            "".join(traceback.format_exception(*exc_info)),
+            datetime.datetime.now(datetime.timezone.utc),
+        )
+        self._push(error)
+        if len(self._pending) >= self.batch_size:
+            self._flush_now.set()
+        return error.error_id
+
+    def get_pending(self, error_id: uuid.UUID) -> PendingError | None:
+        return next((error for error in self._pending if error.error_id == error_id), None)
+
+    def _push(self, error: PendingError) -> None:
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append(error)
+
+    async def _write(self, batch: list[PendingError]) -> None:
+        groups: dict[str, list[t.Any]] = {}
+        for error in batch:
+            if (group := groups.get(error.fingerprint)) is None:
+                groups[error.fingerprint] = [error.fingerprint, error.message, 1, error.timestamp, error.timestamp]
+            else:
+                group[2] += 1
+                group[3] = min(group[3], error.timestamp)
+                group[4] = max(group[4], error.timestamp)
+
+        # maintain creates them ahead, this covers a bot that was offline for longer than that
+        months = {error.timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0) for error in batch}
+        months -= self._partitions
+
+        async with self.db.transaction() as conn:
+            if months:
+                await conn.execute("SELECT errors_ensure_partition(m) FROM unnest($1::timestamptz[]) m", list(months))
+            await conn.execute_many(
+                "INSERT INTO error_groups (fingerprint, message, occurrences, first_seen, last_seen) "
+                "VALUES ($1, $2, $3, $4, $5) ON CONFLICT (fingerprint) DO UPDATE SET "
+                "occurrences = error_groups.occurrences + EXCLUDED.occurrences, "
+                "last_seen = GREATEST(error_groups.last_seen, EXCLUDED.last_seen)",
+                list(groups.values()),
+            )
+            await conn.copy_records(
+                "errors",
+                [(error.error_id, error.fingerprint, error.timestamp) for error in batch],
+                ("error_id", "fingerprint", "timestamp"),
+            )
+        self._partitions |= months
+
+    async def flush(self) -> None:
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            try:
+                await self._write(batch)
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError):
+                log.warning("Could not write %d errors to the database", len(batch), exc_info=True)
+                self._requeue(batch)
+                break
+            except asyncio.CancelledError:
+                self._requeue(batch)
+                raise
+
+        if self.dropped > self._reported_drops:
+            log.warning("Dropped %d errors because the error buffer was full", self.dropped - self._reported_drops)
+            self._reported_drops = self.dropped
+
+    def _requeue(self, batch: list[PendingError]) -> None:
+        # put the batch back in front of newer errors, as far as there is room for it
+        free = t.cast(int, self._pending.maxlen) - len(self._pending)
+        keep = batch[max(0, len(batch) - free) :]
+        self.dropped += len(batch) - len(keep)
+        self._pending.extendleft(reversed(keep))
+
+    async def maintain(self) -> None:
+        # the errors table is partitioned by month, old months are dropped as a whole
+        await self.db.execute(
+            "SELECT errors_ensure_partition(now()), errors_ensure_partition(now() + interval '1 month')"
+        )
+
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - self.retention
+        partitions = await self.db.fetch_column(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'errors'::regclass"
+        )
+        for name in partitions:
+            year, month = int(name[-6:-2]), int(name[-2:])
+            end = datetime.datetime(year + month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+            if end <= cutoff:
+                await self.db.execute(f'DROP TABLE IF EXISTS "{name}"')
+                log.info("Dropped error partition %s", name)
+
+        # only groups whose every occurrence was in a dropped partition
+        boundary = cutoff.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        await self.db.execute("DELETE FROM error_groups WHERE last_seen < $1", boundary)
+
+    async def _run(self) -> None:
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+
+__all__ = ["ErrorRecorder", "PendingError", "fingerprint"]
@@ -1,19 +1,35 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import os
+import signal
+from asyncio.subprocess import PIPE
 from io import BytesIO
-from subprocess import PIPE
-from subprocess import run
+from uuid import UUID
 
 import hikari
 import lightbulb
 
 from kangakari import Config
+from kangakari.utils.profiler import SamplingProfiler
 
 plugin = lightbulb.Plugin("Admin", default_enabled_guilds=Config.TEST_GUILD_ID)
 
 log = logging.getLogger(__name__)
 
+# per stream, whatever comes after this is read and thrown away so the process doesn't block on a full pipe
+SHELL_OUTPUT_LIMIT = 1024 * 1024
+# longer output is sent as a file
+SHELL_INLINE_LIMIT = 1800
+# the command is echoed back in the message, the file gets all of it
+SHELL_COMMAND_LIMIT = 200
+# after a kill, how long to wait for the pipes to close, something that left the process group can hold them open
+SHELL_DRAIN_TIMEOUT = 5.0
+shell_semaphore = asyncio.Semaphore(2)
+PROFILE_MAX_SECONDS = 120.0
+profile_lock = asyncio.Lock()
+
 
 @plugin.command
 @lightbulb.add_checks(lightbulb.owner_only)
@@ -51,13 +67,109 @@ async def cmd_python(ctx: lightbulb.context.SlashContext) -> None:
 
 @plugin.command
 @lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.option("timeout", "Seconds after which the command is killed.", float, default=30.0)
 @lightbulb.option("cmd", "The command to evaluate.")
 @lightbulb.command("shell", "Evaluate shell code.", ephemeral=True)
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_sh(ctx: lightbulb.context.SlashContext) -> None:
     cmd = ctx.options.cmd
-    p = run(cmd, stdout=PIPE, stderr=PIPE)
-    await ctx.respond(f"```sh\n$ {cmd}```**stdout:**```\n{p.stdout.decode()}```**stderr:**```\n{p.stderr.decode()}```")
+    if shell_semaphore.locked():
+        await ctx.respond("Too many shell commands are running already.")
+        return
+
+    async with shell_semaphore:
+        await ctx.respond(hikari.ResponseType.DEFERRED_MESSAGE_CREATE)
+        # its own process group, so a timeout kills whatever the shell started too
+        process = await asyncio.create_subprocess_shell(
+            cmd, stdin=asyncio.subprocess.DEVNULL, stdout=PIPE, stderr=PIPE, start_new_session=os.name != "nt"
+        )
+        assert process.stdout is not None and process.stderr is not None
+        stdout, stderr = bytearray(), bytearray()
+        readers = [
+            asyncio.create_task(_read_bounded(process.stdout, stdout)),
+            asyncio.create_task(_read_bounded(process.stderr, stderr)),
+        ]
+        try:
+            # the pipes close once everything that inherited them exited, background jobs included
+            _, pending = await asyncio.wait(readers, timeout=ctx.options.timeout)
+            if killed := bool(pending):
+                _kill(process)
+                _, pending = await asyncio.wait(pending, timeout=SHELL_DRAIN_TIMEOUT)
+            # what a reader that didn't finish read so far is kept
+            stdout_truncated, stderr_truncated = (reader in pending or reader.result() for reader in readers)
+            await process.wait()
+        finally:
+            # on cancellation or an error nothing may outlive the command
+            for reader in readers:
+                reader.cancel()
+            if process.returncode is None:
+                _kill(process)
+        status = f"killed after {ctx.options.timeout:g}s" if killed else f"exited with {process.returncode}"
+
+    shown = cmd if len(cmd) <= SHELL_COMMAND_LIMIT else cmd[:SHELL_COMMAND_LIMIT] + "…"
+    out = stdout.decode(errors="replace") + ("\n[truncated]" if stdout_truncated else "")
+    err = stderr.decode(errors="replace") + ("\n[truncated]" if stderr_truncated else "")
+    if len(out) + len(err) <= SHELL_INLINE_LIMIT:
+        await ctx.respond(f"```sh\n$ {shown}```{status}\n**stdout:**```\n{out}```**stderr:**```\n{err}```")
+        return
+
+    b = BytesIO(f"$ {cmd}\n{status}\n\nstdout:\n{out}\n\nstderr:\n{err}\n".encode())
+    b.seek(0)
+    await ctx.respond(f"```sh\n$ {shown}```{status}", attachment=hikari.Bytes(b, "shell.txt"))
+
+
+async def _read_bounded(stream: asyncio.StreamReader, buffer: bytearray) -> bool:
+    truncated = False
+    while chunk := await stream.read(64 * 1024):
+        room = SHELL_OUTPUT_LIMIT - len(buffer)
+        if len(chunk) > room:
+            truncated = True
+        if room > 0:
+            buffer += chunk[:room]
+    return truncated
+
+
+def _kill(process: asyncio.subprocess.Process) -> None:
+    try:
+        if os.name == "nt":
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+@plugin.command
+@lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.option("interval", "Milliseconds between samples.", float, default=5.0)
+@lightbulb.option("seconds", "How long to sample for.", float, default=10.0)
+@lightbulb.command("profile", "Sample the stacks of every thread in the bot.", ephemeral=True)
+@lightbulb.implements(lightbulb.commands.SlashCommand)
+async def cmd_profile(ctx: lightbulb.context.SlashContext) -> None:
+    seconds, interval = ctx.options.seconds, ctx.options.interval
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or interval < 1:
+        await ctx.respond(f"Sample for up to {PROFILE_MAX_SECONDS:g} seconds, at most every millisecond.")
+        return
+    if profile_lock.locked():
+        await ctx.respond("A profile is being taken already.")
+        return
+
+    async with profile_lock:
+        await ctx.respond(hikari.ResponseType.DEFERRED_MESSAGE_CREATE)
+        profile = await SamplingProfiler(interval / 1000).profile(seconds)
+
+    lines = [f"{'self':>6} {'total':>6}  function"]
+    samples = max(profile.samples, 1)
+    for function, own, total in profile.top(15):
+        lines.append(f"{own / samples:>6.1%} {total / samples:>6.1%}  {function[:70]}")
+    summary = "\n".join(lines)
+
+    b = BytesIO(profile.collapsed().encode())
+    b.seek(0)
+    await ctx.respond(
+        f"`{profile.samples}` samples over `{profile.duration:.1f}s`\n```\n{summary}```",
+        attachment=hikari.Bytes(b, "profile.folded"),
+    )
 
 
 @plugin.command
@@ -67,17 +179,64 @@ async def cmd_sh(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_error(ctx: lightbulb.context.SlashContext) -> None:
     id = ctx.options.id
-    record = await ctx.bot.d.db.fetch_record("SELECT message, timestamp FROM errors WHERE error_id = $1", id)
+    try:
+        error_id = UUID(id)
+    except ValueError:
+        await ctx.respond("No error with that ID.")
+        return
+
+    record = ctx.bot.d.errors.get_pending(error_id) or await ctx.bot.d.db.fetch_record(
+        "SELECT g.message, e.timestamp FROM errors e JOIN error_groups g USING (fingerprint) WHERE e.error_id = $1",
+        error_id,
+    )
     if record is None:
         await ctx.respond("No error with that ID.")
         return
 
-    message, timestamp = record
+    *_, message, timestamp = record
     b = BytesIO(message.encode())
     b.seek(0)
     await ctx.respond(f"Error on <t:{int(timestamp.timestamp())}:f>", attachment=hikari.Bytes(b, f"error_{id}.txt"))
 
 
+@plugin.command
+@lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.option("sort", "What to sort the statements by.", choices=["total", "p99"], default="total")
+@lightbulb.option("top", "The amount of statements to show.", int, default=10)
+@lightbulb.command("db_stats", "Get the slowest database statements.", ephemeral=True)
+@lightbulb.implements(lightbulb.commands.SlashCommand)
+async def cmd_db_stats(ctx: lightbulb.context.SlashContext) -> None:
+    stats = ctx.bot.d.db.stats
+    if stats is None:
+        await ctx.respond("Query statistics are disabled.")
+        return
+
+    lines = [f"{'calls':>7} {'total ms':>9} {'p99 ms':>8} {'wait p99':>8} {'rows':>9} {'rows p99':>8}  statement"]
+    for sql, s in stats.top(min(ctx.options.top, 25), ctx.options.sort):
+        lines.append(
+            f"{s.execution.count:>7} {s.execution.sum * 1000:>9.1f} {s.execution.quantile(0.99) * 1000:>8.2f} "
+            f"{s.wait.quantile(0.99) * 1000:>8.2f} {int(s.rows.sum):>9} {s.rows.quantile(0.99):>8.0f}  {sql[:80]}"
+        )
+
+    b = BytesIO("\n".join(lines).encode())
+    b.seek(0)
+    await ctx.respond(f"Top statements by {ctx.options.sort} time.", attachment=hikari.Bytes(b, "db_stats.txt"))
+
+
+@plugin.command
+@lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.command("cache_stats", "Get the statistics of the in-process cache.", ephemeral=True)
+@lightbulb.implements(lightbulb.commands.SlashCommand)
+async def cmd_cache_stats(ctx: lightbulb.context.SlashContext) -> None:
+    cache = ctx.bot.d.cache
+    lines = [f"Size: `{cache.size / 1024 / 1024:,.1f}/{cache.max_bytes / 1024 / 1024:,.1f} MiB`"]
+    for kind, s in cache.stats.items():
+        lines.append(
+            f"{kind.title()}: `{s.hits}` hits, `{s.misses}` misses ({s.hit_rate:.1%}), `{s.evictions}` evictions"
+        )
+    await ctx.respond("\n".join(lines))
+
+
 def load(bot: lightbulb.BotApp) -> None:
     bot.add_plugin(plugin)
 
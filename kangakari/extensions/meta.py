@@ -63,21 +63,21 @@ async def cmd_ping(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.command("guild_info", "Get information about this guild.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_guild_info(ctx: lightbulb.context.SlashContext) -> None:
-    guild = await ctx.bot.d.redis_cache.get_guild(ctx.guild_id)
-    ms = guild.get_members()
-    cs = guild.get_channels()
+    guild = await ctx.bot.d.cache.get_guild(ctx.guild_id)
+    stats = ctx.bot.d.guild_stats.get(guild.id)
+    if stats is None:
+        await ctx.respond("The statistics for this guild are not available yet.")
+        return
     guild_id = guild.id
+    owner = await ctx.bot.d.cache.get_member(guild_id, guild.owner_id)
 
     await ctx.respond(
         f"Created at: <t:{int(guild.created_at.timestamp())}:f>\n"
-        f"Owner: `{ctx.bot.cache.get_member(guild_id, guild.owner_id).display_name}`\n"
+        f"Owner: `{owner.display_name}`\n"
         f"Verify level: `{str(guild.verification_level).title()}`\n"
         f"ID: `{guild_id}`\nEmojis: `{len(guild.get_emojis())}`\nRoles: `{len(guild.get_roles())}`\n\n"
-        f"**Members**\nTotal: `{len(ms)}`\nHumans: `{len([m for m in ms.values() if not m.is_bot])}`\n"
-        f"Bots: `{len([m for m in ms.values() if m.is_bot])}`\n\n"
-        f"**Channels**\nVoice: `{len([c for c in cs.values() if c.type == hikari.ChannelType.GUILD_VOICE])}`\n"
-        f"NSFW: `{len([c for c in cs.values() if c.is_nsfw])}`\n"
-        f"Text: `{len([c for c in cs.values() if c.type == hikari.ChannelType.GUILD_TEXT])}`"
+        f"**Members**\nTotal: `{stats.members}`\nHumans: `{stats.humans}`\nBots: `{stats.bots}`\n\n"
+        f"**Channels**\nVoice: `{stats.voice}`\nNSFW: `{stats.nsfw}`\nText: `{stats.text}`"
     )
 
 
@@ -114,8 +114,9 @@ async def cmd_bot_info(ctx: lightbulb.context.SlashContext) -> None:
     ctx.bot.get_me()
     await ctx.respond(
         f"Developer(s): {' | '.join(f'<@{owner_id}>' for owner_id in ctx.bot.owner_ids)}\n"
-        f"Guilds: `{len(ctx.bot.cache.get_available_guilds_view())}`\n"
-        f"Users: `{len(ctx.bot.cache.get_users_view())}`\n"
+        # counted from the shards of this process, a user is counted once per guild they share with the bot
+        f"Guilds (this process): `{len(ctx.bot.d.guild_stats)}`\n"
+        f"Guild memberships (this process): `{ctx.bot.d.guild_stats.members}`\n"
         f"Commands: `{len(ctx.bot.slash_commands)}`\n"
         f"Python version: `{platform.python_version()}`\n"
         f"Hikari version: `{hikari.__version__}`\n"
@@ -130,7 +131,6 @@ async def cmd_bot_info(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_role_info(ctx: lightbulb.context.SlashContext) -> None:
     role = ctx.options.role
-    ms = ctx.get_guild().get_members()
 
     await ctx.respond(
         f"Created at: <t:{int(role.created_at.timestamp())}:f>\n"
@@ -140,7 +140,7 @@ async def cmd_role_info(ctx: lightbulb.context.SlashContext) -> None:
         f"Mentionable? `{role.is_mentionable}`\n"
         f"Colo(u)r: `{role.color.hex_code}`\n"
         f"Position: `{role.position}`\n"
-        f"Members: `{len([m for m in  ms.values() if role.id in m.role_ids])}`"
+        f"Members: `{ctx.bot.d.role_index.member_count(role.guild_id, role.id)}`"
     )
 
 
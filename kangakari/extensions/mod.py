@@ -1,10 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+import datetime
+import logging
+import time
+
 import hikari
 import lightbulb
 
+log = logging.getLogger(__name__)
+
 plugin = lightbulb.Plugin("Mod")
 
+# a little under 14 days, so messages don't age past the limit between fetching and deleting them
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+CLEAR_WORKERS = 4
+CLEAR_QUEUE_SIZE = 200
+PROGRESS_INTERVAL = 2.0
+
 
 @plugin.command
 @lightbulb.add_checks(lightbulb.has_guild_permissions(hikari.Permissions.BAN_MEMBERS))
@@ -16,25 +29,100 @@ async def cmd_unban(ctx: lightbulb.context.SlashContext) -> None:
     user = ctx.options.user
     reason = ctx.options.reason
     try:
-        await ctx.get_guild().unban(user, reason=reason)
+        await ctx.bot.rest.unban_user(ctx.guild_id, user, reason=reason)
     except hikari.NotFoundError:
         await ctx.respond("That user is not banned from this guild.")
         return
     await ctx.respond(f"Unbanned `{user.username}` for reason `{reason}`.")
 
 
+class _ClearProgress:
+    def __init__(self, ctx: lightbulb.context.SlashContext, amount: int):
+        self.ctx = ctx
+        self.amount = amount
+        self.deleted = 0
+        self.failed = 0
+        self._last_update = time.monotonic()
+        # the interaction token runs out after 15 minutes, long clears keep going without progress after that
+        self._broken = False
+
+    async def update(self, *, force: bool = False) -> None:
+        if self._broken:
+            return
+        # editing the response is rate limited too, so only do it every few seconds
+        if not force and time.monotonic() - self._last_update < PROGRESS_INTERVAL:
+            return
+        self._last_update = time.monotonic()
+        content = f"Deleted {self.deleted}/{self.amount} messages."
+        if self.failed:
+            content += f" {self.failed} could not be deleted."
+        try:
+            await self.ctx.edit_last_response(content)
+        except hikari.HTTPError:
+            log.warning("Could not update the clear progress, giving up on it", exc_info=True)
+            self._broken = True
+
+
+async def _delete_old(
+    rest: hikari.api.RESTClient,
+    channel_id: hikari.SnowflakeishOr[hikari.TextableChannel],
+    queue: asyncio.Queue[hikari.Snowflake | None],
+    progress: _ClearProgress,
+) -> None:
+    # hikari waits for the rate limit bucket, the workers only add concurrency
+    # a worker never stops before its sentinel, the command would block on a full queue otherwise
+    while (message_id := await queue.get()) is not None:
+        try:
+            await rest.delete_message(channel_id, message_id)
+        except hikari.NotFoundError:
+            pass
+        except Exception:
+            log.exception("Could not delete message %s", message_id)
+            progress.failed += 1
+            continue
+        progress.deleted += 1
+        await progress.update()
+
+
 @plugin.command
 @lightbulb.add_checks(lightbulb.has_guild_permissions(hikari.Permissions.MANAGE_MESSAGES))
 @lightbulb.option("amount", "The amount of messages to clear.", int)
 @lightbulb.command("clear", "Clear messages.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_clear(ctx: lightbulb.context.SlashContext) -> None:
-    channel = ctx.get_channel()
-    messages = list(await channel.fetch_history().limit(ctx.options.amount + 1))
+    rest = ctx.bot.rest
+    amount = ctx.options.amount
+    if amount < 1:
+        await ctx.respond("The amount has to be at least 1.")
+        return
+    progress = _ClearProgress(ctx, amount)
+    await ctx.respond("Clearing messages...", flags=hikari.MessageFlag.EPHEMERAL)
+
+    # messages older than 14 days can't be bulk deleted, they go to the workers one by one
+    queue: asyncio.Queue[hikari.Snowflake | None] = asyncio.Queue(CLEAR_QUEUE_SIZE)
+    workers = [asyncio.create_task(_delete_old(rest, ctx.channel_id, queue, progress)) for _ in range(CLEAR_WORKERS)]
     try:
-        await channel.delete_messages(messages)
-    except hikari.BulkDeleteError:
-        await ctx.respond("You can only bulk delete messages that are under 14 days old.")
+        bulk_cutoff = datetime.datetime.now(datetime.timezone.utc) - BULK_DELETE_MAX_AGE
+        async for page in rest.fetch_messages(ctx.channel_id).limit(amount).chunk(100):
+            recent = [message.id for message in page if message.created_at > bulk_cutoff]
+            if recent:
+                try:
+                    await rest.delete_messages(ctx.channel_id, recent)
+                except hikari.BulkDeleteError as e:
+                    progress.deleted += len(e.messages_deleted)
+                    progress.failed += len(recent) - len(e.messages_deleted)
+                else:
+                    progress.deleted += len(recent)
+                await progress.update()
+            for message in page:
+                if message.created_at <= bulk_cutoff:
+                    await queue.put(message.id)
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    await progress.update(force=True)
 
 
 @plugin.command
@@ -43,9 +131,10 @@ async def cmd_clear(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.command("clear_channel", "Clear a channel.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_clear_channel(ctx: lightbulb.context.SlashContext) -> None:
-    channel = await ctx.bot.d.redis_cache.get_guild_channel(ctx.options.channel.id)
-    await ctx.get_guild().create_text_channel(
-        name=channel.name,
+    channel = await ctx.bot.d.cache.get_guild_channel(ctx.options.channel.id)
+    await ctx.bot.rest.create_guild_text_channel(
+        ctx.guild_id,
+        channel.name,
         position=channel.position,
         topic=channel.topic,
         nsfw=channel.is_nsfw,
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 
 import hikari
@@ -7,18 +8,35 @@ import lavasnek_rs
 import lightbulb
 
 from kangakari import Config
+from kangakari.lavalink import Node
+from kangakari.lavalink import NodePool
+from kangakari.lavalink import NoNodesAvailable
+from kangakari.lavalink import QueueStore
+from kangakari.lavalink import TrackSearchCache
 
 plugin = lightbulb.Plugin("Music")
 
 log = logging.getLogger(__name__)
 
+# the loop only keeps weak references to tasks
+restores: set[asyncio.Task[None]] = set()
+
 
 class EventHandler:
+    def __init__(self, queue_store: QueueStore, node: Node):
+        self.queue_store = queue_store
+        self.node = node
+
+    async def stats(self, _: lavasnek_rs.Lavalink, event: lavasnek_rs.Stats) -> None:
+        self.node.update_stats(event)
+
     async def track_start(self, _: lavasnek_rs.Lavalink, event: lavasnek_rs.TrackStart) -> None:
         log.info("Track started on guild: %s", event.guild_id)
+        await self.queue_store.track_start(event.guild_id)
 
     async def track_finish(self, _: lavasnek_rs.Lavalink, event: lavasnek_rs.TrackFinish) -> None:
         log.info("Track finished on guild: %s", event.guild_id)
+        await self.queue_store.track_finish(event.guild_id)
 
     async def track_exception(self, lavalink: lavasnek_rs.Lavalink, event: lavasnek_rs.TrackException) -> None:
         log.warning("Track exception event happened on guild: %d", event.guild_id)
@@ -33,42 +51,69 @@ class EventHandler:
             await lavalink.stop(event.guild_id)
 
 
+async def _lavalink(ctx: lightbulb.Context, *, place: bool = False) -> lavasnek_rs.Lavalink | None:
+    assert ctx.guild_id is not None
+    pool: NodePool = plugin.bot.d.lavalink
+    try:
+        return pool.place(ctx.guild_id) if place else pool.get(ctx.guild_id)
+    except NoNodesAvailable:
+        await ctx.respond("No music nodes are available right now, try again later.")
+        return None
+
+
 async def _join(ctx: lightbulb.Context) -> hikari.Snowflake | None:
     assert ctx.guild_id is not None
 
-    states = plugin.bot.cache.get_voice_states_view_for_guild(ctx.guild_id)
-    voice_state = [state async for state in states.iterator().filter(lambda i: i.user_id == ctx.author.id)]
+    channel_id: hikari.Snowflake | None = plugin.bot.d.voice_states.get_channel(ctx.guild_id, ctx.author.id)
 
-    if not voice_state:
+    if channel_id is None:
         await ctx.respond("Connect to a voice channel first.")
         return None
 
-    channel_id = voice_state[0].channel_id
-
+    if (lavalink := await _lavalink(ctx, place=True)) is None:
+        return None
     await plugin.bot.update_voice_state(ctx.guild_id, channel_id, self_deaf=True)
-    connection_info = await plugin.bot.d.lavalink.wait_for_full_connection_info_insert(ctx.guild_id)
+    connection_info = await lavalink.wait_for_full_connection_info_insert(ctx.guild_id)
 
-    await plugin.bot.d.lavalink.create_session(connection_info)
+    await lavalink.create_session(connection_info)
 
     return channel_id
 
 
 @plugin.listener(hikari.ShardReadyEvent)
 async def on_shard_ready(event: hikari.ShardReadyEvent) -> None:
-    builder = (
-        lavasnek_rs.LavalinkBuilder(event.my_user.id, "")
-        .set_host(Config.LAVALINK_HOST)
-        .set_password(Config.LAVALINK_PASSWORD)
-    )
+    pool: NodePool = plugin.bot.d.lavalink
+    # the nodes are shared by every shard and outlive resumes, so they are only built once
+    await pool.connect(plugin.bot, lambda node: EventHandler(plugin.bot.d.queue_store, node))
+
+    # resume the queues of this shard's guilds that were playing before a restart
+    guild_ids = [
+        guild_id
+        for guild_id in await plugin.bot.d.queue_store.guilds()
+        if hikari.snowflakes.calculate_shard_id(plugin.bot, guild_id) == event.shard.id
+        and pool.get_node(guild_id) is None
+    ]
+    # without nodes the pool restores them once it connects to one
+    if guild_ids and pool.connected:
+        task = asyncio.create_task(plugin.bot.d.queue_store.restore_all(plugin.bot, pool, guild_ids))
+        restores.add(task)
+        task.add_done_callback(restores.discard)
 
-    builder.set_start_gateway(False)
 
-    plugin.bot.d.lavalink = await builder.build(EventHandler())
+@plugin.listener(hikari.StoppingEvent)
+async def on_stopping(_: hikari.StoppingEvent) -> None:
+    await plugin.bot.d.lavalink.close()
 
 
 @plugin.listener(hikari.VoiceStateUpdateEvent)
 async def voice_state_update(event: hikari.VoiceStateUpdateEvent) -> None:
-    plugin.bot.d.lavalink.raw_handle_event_voice_state_update(
+    # Lavalink only needs the bot's own voice state
+    me = plugin.bot.get_me()
+    if me is None or event.state.user_id != me.id:
+        return
+    if (node := plugin.bot.d.lavalink.get_node(event.state.guild_id)) is None:
+        return
+    node.lavalink.raw_handle_event_voice_state_update(
         event.state.guild_id,
         event.state.user_id,
         event.state.session_id,
@@ -78,7 +123,9 @@ async def voice_state_update(event: hikari.VoiceStateUpdateEvent) -> None:
 
 @plugin.listener(hikari.VoiceServerUpdateEvent)
 async def voice_server_update(event: hikari.VoiceServerUpdateEvent) -> None:
-    await plugin.bot.d.lavalink.raw_handle_event_voice_server_update(event.guild_id, event.endpoint, event.token)
+    if (node := plugin.bot.d.lavalink.get_node(event.guild_id)) is None:
+        return
+    await node.lavalink.raw_handle_event_voice_server_update(event.guild_id, event.endpoint, event.token)
 
 
 @plugin.command
@@ -97,14 +144,18 @@ async def cmd_join(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.command("leave", "Leave the voice channel the bot is in.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_leave(ctx: lightbulb.context.SlashContext) -> None:
-    await plugin.bot.d.lavalink.destroy(ctx.guild_id)
+    if (lavalink := await _lavalink(ctx)) is None:
+        return
+    await lavalink.destroy(ctx.guild_id)
 
     if ctx.guild_id is not None:
         await plugin.bot.update_voice_state(ctx.guild_id, None)
-        await plugin.bot.d.lavalink.wait_for_connection_info_remove(ctx.guild_id)
+        await lavalink.wait_for_connection_info_remove(ctx.guild_id)
 
-    await plugin.bot.d.lavalink.remove_guild_node(ctx.guild_id)
-    await plugin.bot.d.lavalink.remove_guild_from_loops(ctx.guild_id)
+    await lavalink.remove_guild_node(ctx.guild_id)
+    await lavalink.remove_guild_from_loops(ctx.guild_id)
+    plugin.bot.d.lavalink.release(ctx.guild_id)
+    await plugin.bot.d.queue_store.clear(ctx.guild_id)
 
     await ctx.respond("Left voice channel.")
 
@@ -121,20 +172,31 @@ async def cmd_play(ctx: lightbulb.context.SlashContext) -> None:
         await ctx.respond("Please specify a query.")
         return
 
-    con = plugin.bot.d.lavalink.get_guild_gateway_connection_info(ctx.guild_id)
+    if (lavalink := await _lavalink(ctx)) is None:
+        return
+    con = lavalink.get_guild_gateway_connection_info(ctx.guild_id)
     if not con:
-        await _join(ctx)
+        channel_id = await _join(ctx)
+    else:
+        # without its own user the bot can't look its channel up, the queue just isn't saved then
+        me = plugin.bot.get_me()
+        channel_id = plugin.bot.d.voice_states.get_channel(ctx.guild_id, me.id) if me is not None else None
 
-    query_information = await plugin.bot.d.lavalink.auto_search_tracks(query)
+    # _join places the guild on a node, so this is looked up afterwards
+    if (lavalink := await _lavalink(ctx)) is None:
+        return
+    query_information = await plugin.bot.d.track_cache.search(lavalink, query)
 
     if not query_information.tracks:
         await ctx.respond("Could not find any video of the search query.")
         return
     try:
-        await plugin.bot.d.lavalink.play(ctx.guild_id, query_information.tracks[0]).requester(ctx.author.id).queue()
+        await lavalink.play(ctx.guild_id, query_information.tracks[0]).requester(ctx.author.id).queue()
     except lavasnek_rs.NoSessionPresent:
         await ctx.respond("Use /join first.")
         return
+    if channel_id:
+        await plugin.bot.d.queue_store.enqueue(ctx.guild_id, channel_id, query_information.tracks[0], ctx.author.id)
     await ctx.respond(f"Added `{query_information.tracks[0].info.title}` to the queue.")
 
 
@@ -143,7 +205,9 @@ async def cmd_play(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.command("stop", "Stop the song.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_stop(ctx: lightbulb.context.SlashContext) -> None:
-    await plugin.bot.d.lavalink.stop(ctx.guild_id)
+    if (lavalink := await _lavalink(ctx)) is None:
+        return
+    await lavalink.stop(ctx.guild_id)
     await ctx.respond("Stopped playing.")
 
 
@@ -152,14 +216,16 @@ async def cmd_stop(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.command("skip", "Skip the current song.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_skip(ctx: lightbulb.context.SlashContext) -> None:
-    skip = await plugin.bot.d.lavalink.skip(ctx.guild_id)
-    node = await plugin.bot.d.lavalink.get_guild_node(ctx.guild_id)
+    if (lavalink := await _lavalink(ctx)) is None:
+        return
+    skip = await lavalink.skip(ctx.guild_id)
+    node = await lavalink.get_guild_node(ctx.guild_id)
 
     if not skip:
         await ctx.respond("Nothing to skip.")
     else:
         if not node.queue and not node.now_playing:
-            await plugin.bot.d.lavalink.stop(ctx.guild_id)
+            await lavalink.stop(ctx.guild_id)
 
         await ctx.respond(f"Skipped {skip.track.info.title}.")
 
@@ -169,7 +235,10 @@ async def cmd_skip(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.command("pause", "Pause the song.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_pause(ctx: lightbulb.context.SlashContext) -> None:
-    await plugin.bot.d.lavalink.pause(ctx.guild_id)
+    if (lavalink := await _lavalink(ctx)) is None:
+        return
+    await lavalink.pause(ctx.guild_id)
+    await plugin.bot.d.queue_store.pause(ctx.guild_id)
     await ctx.respond("Paused player.")
 
 
@@ -178,11 +247,23 @@ async def cmd_pause(ctx: lightbulb.context.SlashContext) -> None:
 @lightbulb.command("resume", "Resume the song.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_resume(ctx: lightbulb.context.SlashContext) -> None:
-    await plugin.bot.d.lavalink.resume(ctx.guild_id)
+    if (lavalink := await _lavalink(ctx)) is None:
+        return
+    await lavalink.resume(ctx.guild_id)
+    await plugin.bot.d.queue_store.resume(ctx.guild_id)
     await ctx.respond("Resumed player.")
 
 
 def load(bot: lightbulb.BotApp) -> None:
+    bot.d.queue_store = QueueStore(bot.d.redis_cache)
+    if bot.d.get("lavalink") is None:
+        bot.d.lavalink = NodePool(Config.LAVALINK_HOSTS, Config.LAVALINK_PASSWORD, bot.d.queue_store)
+    bot.d.track_cache = TrackSearchCache(
+        bot.d.redis_cache,
+        max_size=Config.TRACK_CACHE_SIZE,
+        ttl=Config.TRACK_CACHE_TTL,
+        redis_ttl=Config.TRACK_CACHE_REDIS_TTL,
+    )
     bot.add_plugin(plugin)
 
 
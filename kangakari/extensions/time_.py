@@ -2,10 +2,11 @@ from __future__ import annotations
 
 import datetime
 
+import hikari
 import lightbulb
-import pytz
 
 from kangakari.utils import helpers
+from kangakari.utils.timezones import TimezoneIndex
 
 plugin = lightbulb.Plugin("Time")
 
@@ -16,43 +17,50 @@ plugin = lightbulb.Plugin("Time")
 @lightbulb.command("reminder", "Create a reminder.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_reminder(ctx: lightbulb.context.SlashContext) -> None:
-    timedelta = helpers.str_to_timedelta(ctx.options.timedelta)
-    if timedelta is None:
-        await ctx.respond("Couldn't convert timedelta.")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        timedelta = helpers.parse_duration(ctx.options.timedelta, now)
+    except helpers.DurationError as e:
+        await ctx.respond(str(e))
+        return
+    if timedelta <= datetime.timedelta():
+        await ctx.respond("The reminder has to be in the future.")
         return
-    text = ctx.options.text
-    ctx.bot.d.scheduler.add_job(
-        ctx.respond,
-        "date",
-        (f"{ctx.author.mention}\nReminder{f': `{text}`' if text else ''}",),
-        {"user_mentions": True},
-        next_run_time=datetime.datetime.now() + timedelta,
-    )
+    await ctx.bot.d.reminders.schedule(ctx.channel_id, ctx.author.id, ctx.options.text, now + timedelta)
     await ctx.respond("Created a reminder.")
 
 
 @plugin.command
-@lightbulb.option("timezone", "The timezone.", default="UTC")
+@lightbulb.option("timezone", "The timezone.", default="UTC", autocomplete=True)
 @lightbulb.option("timedelta", "The timedelta.")
 @lightbulb.command("time_in", "Get the time.")
 @lightbulb.implements(lightbulb.commands.SlashCommand)
 async def cmd_time_in(ctx: lightbulb.context.SlashContext) -> None:
-    timedelta = helpers.str_to_timedelta(ctx.options.timedelta)
-    if timedelta is None:
-        await ctx.respond("Couldn't convert timedelta.")
+    if (timezone := ctx.bot.d.timezones.resolve(ctx.options.timezone)) is None:
+        await ctx.respond("Unknown timezone.")
         return
+    # dates and times are read in the given timezone
+    now = datetime.datetime.now(timezone)
     try:
-        timezone = pytz.timezone(ctx.options.timezone)
-    except pytz.UnknownTimeZoneError:
-        await ctx.respond("Unknown timezone.")
+        timedelta = helpers.parse_duration(ctx.options.timedelta, now)
+    except helpers.DurationError as e:
+        await ctx.respond(str(e))
         return
-    unix_timestamp = int(
-        (datetime.datetime.utcnow() + timedelta + timezone.utcoffset(datetime.datetime.utcnow())).timestamp()
-    )
-    await ctx.respond(f"It will be <t:{unix_timestamp}:f>.")
+    then = timezone.normalize(now + timedelta)
+    await ctx.respond(f"It will be {then:%Y-%m-%d %H:%M} in {timezone.zone} (<t:{int(then.timestamp())}:f>).")
+
+
+@cmd_time_in.autocomplete("timezone")
+async def time_in_timezone_autocomplete(
+    opt: hikari.AutocompleteInteractionOption, _: hikari.AutocompleteInteraction
+) -> list[str]:
+    timezones: TimezoneIndex = plugin.bot.d.timezones
+    # the value is missing until something is typed
+    return timezones.search(str(opt.value or ""))
 
 
 def load(bot: lightbulb.BotApp) -> None:
+    bot.d.timezones = TimezoneIndex()
     bot.add_plugin(plugin)
 
 
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import typing as t
+
+import hikari
+
+
+class GuildStats:
+    __slots__ = ("_members", "bots", "_channels", "voice", "nsfw", "text")
+
+    def __init__(self) -> None:
+        self._members: dict[hikari.Snowflake, bool] = {}
+        self.bots = 0
+        self._channels: dict[hikari.Snowflake, tuple[bool, bool, bool]] = {}
+        self.voice = 0
+        self.nsfw = 0
+        self.text = 0
+
+    @property
+    def members(self) -> int:
+        return len(self._members)
+
+    @property
+    def humans(self) -> int:
+        return len(self._members) - self.bots
+
+    @property
+    def channels(self) -> int:
+        return len(self._channels)
+
+    def add_member(self, user: hikari.User) -> None:
+        if user.id in self._members:
+            return
+        self._members[user.id] = user.is_bot
+        self.bots += user.is_bot
+
+    def remove_member(self, user_id: hikari.Snowflake) -> None:
+        if self._members.pop(user_id, False):
+            self.bots -= 1
+
+    def set_channel(self, channel: hikari.GuildChannel) -> None:
+        self.remove_channel(channel.id)
+        flags = (
+            channel.type == hikari.ChannelType.GUILD_VOICE,
+            bool(channel.is_nsfw),
+            channel.type == hikari.ChannelType.GUILD_TEXT,
+        )
+        self._channels[channel.id] = flags
+        self._count(flags, 1)
+
+    def remove_channel(self, channel_id: hikari.Snowflake) -> None:
+        if (flags := self._channels.pop(channel_id, None)) is not None:
+            self._count(flags, -1)
+
+    def _count(self, flags: tuple[bool, bool, bool], sign: int) -> None:
+        voice, nsfw, text = flags
+        self.voice += sign * voice
+        self.nsfw += sign * nsfw
+        self.text += sign * text
+
+
+class GuildStatsIndex:
+    def __init__(self) -> None:
+        self._guilds: dict[hikari.Snowflake, GuildStats] = {}
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    @property
+    def members(self) -> int:
+        return sum(stats.members for stats in self._guilds.values())
+
+    def get(self, guild_id: hikari.Snowflakeish) -> GuildStats | None:
+        return self._guilds.get(hikari.Snowflake(guild_id))
+
+    def subscribe(self, event_manager: hikari.api.EventManager) -> None:
+        event_manager.subscribe(hikari.GuildAvailableEvent, self._on_guild_create)
+        event_manager.subscribe(hikari.GuildJoinEvent, self._on_guild_create)
+        event_manager.subscribe(hikari.GuildLeaveEvent, self._on_guild_leave)
+        event_manager.subscribe(hikari.MemberChunkEvent, self._on_member_chunk)
+        event_manager.subscribe(hikari.MemberCreateEvent, self._on_member_create)
+        event_manager.subscribe(hikari.MemberDeleteEvent, self._on_member_delete)
+        event_manager.subscribe(hikari.GuildChannelCreateEvent, self._on_channel_set)
+        event_manager.subscribe(hikari.GuildChannelUpdateEvent, self._on_channel_set)
+        event_manager.subscribe(hikari.GuildChannelDeleteEvent, self._on_channel_delete)
+
+    def _stats(self, guild_id: hikari.Snowflake) -> GuildStats | None:
+        # events that come before GUILD_CREATE are dropped, partial counters would look like real ones
+        return self._guilds.get(guild_id)
+
+    async def _on_guild_create(self, event: hikari.GuildAvailableEvent | hikari.GuildJoinEvent) -> None:
+        # the only full pass, everything after this is incremental
+        stats = self._guilds[event.guild_id] = GuildStats()
+        for member in event.members.values():
+            stats.add_member(member.user)
+        for channel in event.channels.values():
+            stats.set_channel(channel)
+
+    async def _on_guild_leave(self, event: hikari.GuildLeaveEvent) -> None:
+        self._guilds.pop(event.guild_id, None)
+
+    async def _on_member_chunk(self, event: hikari.MemberChunkEvent) -> None:
+        if (stats := self._stats(event.guild_id)) is None:
+            return
+        for member in event.members.values():
+            stats.add_member(member.user)
+
+    async def _on_member_create(self, event: hikari.MemberCreateEvent) -> None:
+        if (stats := self._stats(event.guild_id)) is not None:
+            stats.add_member(event.user)
+
+    async def _on_member_delete(self, event: hikari.MemberDeleteEvent) -> None:
+        if (stats := self._stats(event.guild_id)) is not None:
+            stats.remove_member(event.user.id)
+
+    async def _on_channel_set(self, event: hikari.GuildChannelCreateEvent | hikari.GuildChannelUpdateEvent) -> None:
+        if (stats := self._stats(event.guild_id)) is not None:
+            stats.set_channel(event.channel)
+
+    async def _on_channel_delete(self, event: hikari.GuildChannelDeleteEvent) -> None:
+        if (stats := self._stats(event.guild_id)) is not None:
+            stats.remove_channel(event.channel.id)
+
+
+class RoleIndex:
+    def __init__(self) -> None:
+        self._roles: dict[hikari.Snowflake, dict[hikari.Snowflake, set[hikari.Snowflake]]] = {}
+        self._members: dict[hikari.Snowflake, dict[hikari.Snowflake, frozenset[hikari.Snowflake]]] = {}
+
+    def members_with_role(
+        self, guild_id: hikari.Snowflakeish, role_id: hikari.Snowflakeish
+    ) -> t.AbstractSet[hikari.Snowflake]:
+        return self._roles.get(hikari.Snowflake(guild_id), {}).get(hikari.Snowflake(role_id), frozenset())
+
+    def member_count(self, guild_id: hikari.Snowflakeish, role_id: hikari.Snowflakeish) -> int:
+        return len(self.members_with_role(guild_id, role_id))
+
+    def roles_of(self, guild_id: hikari.Snowflakeish, user_id: hikari.Snowflakeish) -> t.AbstractSet[hikari.Snowflake]:
+        return self._members.get(hikari.Snowflake(guild_id), {}).get(hikari.Snowflake(user_id), frozenset())
+
+    def subscribe(self, event_manager: hikari.api.EventManager) -> None:
+        event_manager.subscribe(hikari.GuildAvailableEvent, self._on_guild_create)
+        event_manager.subscribe(hikari.GuildJoinEvent, self._on_guild_create)
+        event_manager.subscribe(hikari.GuildLeaveEvent, self._on_guild_leave)
+        event_manager.subscribe(hikari.MemberChunkEvent, self._on_member_chunk)
+        event_manager.subscribe(hikari.MemberCreateEvent, self._on_member_set)
+        event_manager.subscribe(hikari.MemberUpdateEvent, self._on_member_set)
+        event_manager.subscribe(hikari.MemberDeleteEvent, self._on_member_delete)
+        event_manager.subscribe(hikari.RoleDeleteEvent, self._on_role_delete)
+
+    def _set_member(self, guild_id: hikari.Snowflake, member: hikari.Member) -> None:
+        roles = self._roles.setdefault(guild_id, {})
+        members = self._members.setdefault(guild_id, {})
+        new = frozenset(member.role_ids)
+        old = members.get(member.id, frozenset())
+        members[member.id] = new
+
+        for role_id in old - new:
+            self._discard(roles, role_id, member.id)
+        for role_id in new - old:
+            roles.setdefault(role_id, set()).add(member.id)
+
+    def _remove_member(self, guild_id: hikari.Snowflake, user_id: hikari.Snowflake) -> None:
+        roles = self._roles.get(guild_id, {})
+        for role_id in self._members.get(guild_id, {}).pop(user_id, frozenset()):
+            self._discard(roles, role_id, user_id)
+
+    @staticmethod
+    def _discard(
+        roles: dict[hikari.Snowflake, set[hikari.Snowflake]], role_id: hikari.Snowflake, user_id: hikari.Snowflake
+    ) -> None:
+        if (members := roles.get(role_id)) is not None:
+            members.discard(user_id)
+            if not members:
+                del roles[role_id]
+
+    async def _on_guild_create(self, event: hikari.GuildAvailableEvent | hikari.GuildJoinEvent) -> None:
+        self._roles[event.guild_id] = {}
+        self._members[event.guild_id] = {}
+        for member in event.members.values():
+            self._set_member(event.guild_id, member)
+
+    async def _on_guild_leave(self, event: hikari.GuildLeaveEvent) -> None:
+        self._roles.pop(event.guild_id, None)
+        self._members.pop(event.guild_id, None)
+
+    async def _on_member_chunk(self, event: hikari.MemberChunkEvent) -> None:
+        for member in event.members.values():
+            self._set_member(event.guild_id, member)
+
+    async def _on_member_set(self, event: hikari.MemberCreateEvent | hikari.MemberUpdateEvent) -> None:
+        self._set_member(event.guild_id, event.member)
+
+    async def _on_member_delete(self, event: hikari.MemberDeleteEvent) -> None:
+        self._remove_member(event.guild_id, event.user.id)
+
+    async def _on_role_delete(self, event: hikari.RoleDeleteEvent) -> None:
+        # members keep the stale ID until their next update, which is harmless
+        self._roles.get(event.guild_id, {}).pop(event.role_id, None)
+
+
+class VoiceStateIndex:
+    def __init__(self) -> None:
+        self._channels: dict[hikari.Snowflake, dict[hikari.Snowflake, hikari.Snowflake]] = {}
+
+    def get_channel(self, guild_id: hikari.Snowflakeish, user_id: hikari.Snowflakeish) -> hikari.Snowflake | None:
+        return self._channels.get(hikari.Snowflake(guild_id), {}).get(hikari.Snowflake(user_id))
+
+    def subscribe(self, event_manager: hikari.api.EventManager) -> None:
+        event_manager.subscribe(hikari.GuildAvailableEvent, self._on_guild_create)
+        event_manager.subscribe(hikari.GuildJoinEvent, self._on_guild_create)
+        event_manager.subscribe(hikari.GuildLeaveEvent, self._on_guild_leave)
+        event_manager.subscribe(hikari.VoiceStateUpdateEvent, self._on_voice_state_update)
+
+    async def _on_guild_create(self, event: hikari.GuildAvailableEvent | hikari.GuildJoinEvent) -> None:
+        self._channels[event.guild_id] = {
+            user_id: state.channel_id for user_id, state in event.voice_states.items() if state.channel_id is not None
+        }
+
+    async def _on_guild_leave(self, event: hikari.GuildLeaveEvent) -> None:
+        self._channels.pop(event.guild_id, None)
+
+    async def _on_voice_state_update(self, event: hikari.VoiceStateUpdateEvent) -> None:
+        channels = self._channels.setdefault(event.guild_id, {})
+        if event.state.channel_id is None:
+            channels.pop(event.state.user_id, None)
+        else:
+            channels[event.state.user_id] = event.state.channel_id
+
+
+__all__ = ["GuildStats", "GuildStatsIndex", "RoleIndex", "VoiceStateIndex"]
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import socket
+import typing as t
+
+import asyncpg
+
+if t.TYPE_CHECKING:
+    from kangakari import Database
+
+log = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "kangakari_jobs"
+
+Handler = t.Callable[[dict[str, t.Any]], t.Awaitable[None]]
+
+
+class Job(t.NamedTuple):
+    job_id: int
+    kind: str
+    payload: dict[str, t.Any]
+    repeat_every: datetime.timedelta | None
+
+
+class JobQueue:
+    # jobs live in Postgres, every process claims due jobs with SKIP LOCKED so they spread over the processes
+    # a job is deleted (or rescheduled, when it repeats) before its handler runs, so it runs at most once
+
+    def __init__(
+        self,
+        db: Database,
+        *,
+        concurrency: int = 10,
+        lease: datetime.timedelta = datetime.timedelta(minutes=5),
+        max_sleep: float = 60.0,
+    ):
+        self.db = db
+        self.concurrency = concurrency
+        self.lease = lease
+        # notifications can be lost when the listening connection drops, so never sleep longer than this
+        # jobs due further out than a minute aren't notified at all, see 0003_jobs_due.sql
+        self.max_sleep = max_sleep
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers: dict[str, Handler] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wake = asyncio.Event()
+        self._listener: asyncpg.Connection | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._running: set[asyncio.Task[None]] = set()
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: dict[str, t.Any] | None = None,
+        run_at: datetime.datetime | None = None,
+        *,
+        repeat_every: datetime.timedelta | None = None,
+        unique_key: str | None = None,
+    ) -> int | None:
+        # a job with a unique key that already exists isn't enqueued again, that returns None
+        job_id: int | None = await self.db.fetch_val(
+            "INSERT INTO jobs (kind, payload, run_at, repeat_every, unique_key) "
+            "VALUES ($1, $2::jsonb, COALESCE($3, now()), $4, $5) "
+            "ON CONFLICT (unique_key) DO NOTHING RETURNING job_id",
+            kind,
+            json.dumps(payload or {}),
+            run_at,
+            repeat_every,
+            unique_key,
+        )
+        return job_id
+
+    async def start(self) -> None:
+        assert self._task is None
+        self._listener = await self.db.pool.acquire()
+        await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        self._task = asyncio.create_task(self._run())
+        log.info("Started job queue as %s", self.worker_id)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        if self._listener is not None:
+            await self._listener.remove_listener(NOTIFY_CHANNEL, self._on_notify)
+            await self.db.pool.release(self._listener)
+            self._listener = None
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        log.info("Stopped job queue")
+
+    def _on_notify(self, _: asyncpg.Connection, __: int, ___: str, ____: str) -> None:
+        self._wake.set()
+
+    async def _claim(self, limit: int) -> list[Job]:
+        records = await self.db.fetch_all(
+            "WITH due AS ("
+            "SELECT job_id FROM jobs WHERE run_at <= now() AND (leased_until IS NULL OR leased_until < now()) "
+            "ORDER BY run_at, job_id LIMIT $2 FOR UPDATE SKIP LOCKED) "
+            "UPDATE jobs j SET leased_by = $1, leased_until = now() + $3 FROM due WHERE j.job_id = due.job_id "
+            "RETURNING j.job_id, j.kind, j.payload, j.repeat_every",
+            self.worker_id,
+            limit,
+            self.lease,
+        )
+        return [Job(r["job_id"], r["kind"], json.loads(r["payload"]), r["repeat_every"]) for r in records]
+
+    async def _next_due(self) -> datetime.datetime | None:
+        # a leased job becomes claimable again when its lease runs out, in case its process died
+        # a job is claimed once it's due, so a leased job's lease never runs out before its run_at
+        next_due: datetime.datetime | None = await self.db.fetch_val(
+            "SELECT LEAST("
+            "(SELECT run_at FROM jobs WHERE leased_until IS NULL ORDER BY run_at LIMIT 1), "
+            "(SELECT min(leased_until) FROM jobs WHERE leased_until IS NOT NULL))"
+        )
+        return next_due
+
+    async def _poll(self) -> float:
+        # claims what it can and returns how long to wait before polling again
+        self._wake.clear()
+        free = self.concurrency - len(self._running)
+        claimed = await self._claim(free) if free > 0 else []
+        for job in claimed:
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+        if len(self._running) >= self.concurrency:
+            # a finishing job sets the event
+            return self.max_sleep
+        if len(claimed) == free:
+            # there can be more due jobs
+            return 0.0
+        if (next_due := await self._next_due()) is None:
+            return self.max_sleep
+        timeout = (next_due - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        # due jobs that couldn't be claimed are being claimed by another process right now
+        return min(max(timeout, 0.1), self.max_sleep)
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            try:
+                timeout = await self._poll()
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError):
+                failures += 1
+                # notifications don't cut this short, they would keep a broken connection busy
+                backoff = min(2.0**failures, self.max_sleep)
+                log.exception("Could not poll the job queue, retrying in %.0fs", backoff)
+                await asyncio.sleep(backoff)
+                continue
+            failures = 0
+
+            if timeout <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _commit(self, job: Job) -> bool:
+        # only succeeds while the lease is still ours, after that another process may have claimed the job
+        if job.repeat_every is None:
+            query = "DELETE FROM jobs WHERE job_id = $1 AND leased_by = $2 AND leased_until > now() RETURNING job_id"
+        else:
+            query = (
+                "UPDATE jobs SET run_at = now() + repeat_every, leased_by = NULL, leased_until = NULL "
+                "WHERE job_id = $1 AND leased_by = $2 AND leased_until > now() RETURNING job_id"
+            )
+        return await self.db.fetch_val(query, job.job_id, self.worker_id) is not None
+
+    async def _execute(self, job: Job) -> None:
+        try:
+            async with self._semaphore:
+                try:
+                    committed = await self._commit(job)
+                except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError):
+                    # the lease runs out and the job is claimed again
+                    log.exception("Could not commit job %d (%s)", job.job_id, job.kind)
+                    return
+                if not committed:
+                    log.warning("Lost the lease on job %d (%s)", job.job_id, job.kind)
+                    return
+                if (handler := self._handlers.get(job.kind)) is None:
+                    log.error("No handler for job %d (%s)", job.job_id, job.kind)
+                    return
+                try:
+                    await handler(job.payload)
+                except Exception:
+                    log.exception("Job %d (%s) failed", job.job_id, job.kind)
+        finally:
+            self._wake.set()
+
+
+__all__ = ["Job", "JobQueue"]
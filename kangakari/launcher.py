@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+import typing as t
+
+from aiohttp import ClientSession
+
+from kangakari import Config
+from kangakari import bot
+from kangakari.utils.logs import FORMAT
+
+log = logging.getLogger(__name__)
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# discord allows max_concurrency identifies every 5 seconds, across all processes
+IDENTIFY_INTERVAL = 5.0
+RESTART_DELAY = 5.0
+
+
+async def fetch_gateway_info() -> dict[str, t.Any]:
+    async with ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers={"Authorization": f"Bot {Config.TOKEN}"}) as response:
+            response.raise_for_status()
+            info: dict[str, t.Any] = await response.json()
+            return info
+
+
+def shard_groups(shard_count: int, processes: int) -> list[list[int]]:
+    # contiguous and as even as possible, e.g. 10 shards over 3 processes is 4, 3 and 3
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (i < extra)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def _worker(index: int, shard_ids: list[int], shard_count: int) -> None:
+    # spawned processes start from scratch, they read the config themselves
+    Config.load()
+    bot.run(shard_ids, shard_count, worker=index)
+
+
+class Launcher:
+    def __init__(self, groups: list[list[int]], shard_count: int, max_concurrency: int = 1):
+        self.groups = groups
+        self.shard_count = shard_count
+        self.max_concurrency = max_concurrency
+        self.stopping = False
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: dict[int, multiprocessing.process.BaseProcess] = {}
+
+    def _start(self, index: int) -> None:
+        process = self._context.Process(
+            target=_worker, args=(index, self.groups[index], self.shard_count), name=f"kangakari-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+        log.info("Started worker %d (pid %s) with shards %s", index, process.pid, self.groups[index])
+
+    def _identify_delay(self, index: int) -> float:
+        return IDENTIFY_INTERVAL * math.ceil(len(self.groups[index]) / self.max_concurrency)
+
+    def stop(self, *_: t.Any) -> None:
+        self.stopping = True
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        # workers identify one after another, so their shards don't hit the identify limit together
+        for index in range(len(self.groups)):
+            if self.stopping:
+                break
+            self._start(index)
+            if index < len(self.groups) - 1:
+                time.sleep(self._identify_delay(index))
+
+        while self._processes:
+            sentinels = {process.sentinel: index for index, process in self._processes.items()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels)):
+                index = sentinels[t.cast(int, sentinel)]
+                process = self._processes.pop(index)
+                if self.stopping or process.exitcode == 0:
+                    log.info("Worker %d exited with %s", index, process.exitcode)
+                    continue
+                log.error("Worker %d exited with %s, restarting it", index, process.exitcode)
+                time.sleep(RESTART_DELAY)
+                if not self.stopping:
+                    self._start(index)
+
+
+def main() -> None:
+    Config.load()
+    if Config.WORKER_PROCESSES == 1:
+        bot.run(shard_count=Config.SHARD_COUNT)
+        return
+
+    logging.basicConfig(level=logging.INFO, format=FORMAT)
+    info = asyncio.run(fetch_gateway_info())
+    shard_count = Config.SHARD_COUNT or info["shards"]
+    processes = min(Config.WORKER_PROCESSES or os.cpu_count() or 1, shard_count)
+    max_concurrency = info["session_start_limit"]["max_concurrency"]
+    log.info("Running %d shards in %d processes", shard_count, processes)
+
+    Launcher(shard_groups(shard_count, processes), shard_count, max_concurrency).run()
+
+
+__all__ = ["Launcher", "fetch_gateway_info", "main", "shard_groups"]
@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import typing as t
+from collections import OrderedDict
+
+import aioredis
+import hikari
+import lavasnek_rs
+import msgpack
+import sake
+
+log = logging.getLogger(__name__)
+
+# sake keeps every resource in its own Redis database, our keys are prefixed so they never clash with snowflakes
+REDIS_INDEX = sake.redis.ResourceIndex.USER
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+class TrackSearchCache:
+    def __init__(
+        self, redis_cache: sake.redis.ResourceClient, max_size: int = 512, ttl: float = 600.0, redis_ttl: int = 86400
+    ):
+        self.redis_cache = redis_cache
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+        self._entries: OrderedDict[str, tuple[float, lavasnek_rs.Tracks]] = OrderedDict()
+        self._pending: dict[str, asyncio.Task[lavasnek_rs.Tracks]] = {}
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def search(self, lavalink: lavasnek_rs.Lavalink, query: str) -> lavasnek_rs.Tracks:
+        key = normalize_query(query)
+
+        if (entry := self._entries.get(key)) is not None:
+            expires_at, tracks = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return tracks
+            del self._entries[key]
+
+        # concurrent searches for the same query share one lookup, cancelling a waiter doesn't cancel it
+        if (task := self._pending.get(key)) is None:
+            task = self._pending[key] = asyncio.create_task(self._resolve(lavalink, query, key))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    def _store(self, key: str, tracks: lavasnek_rs.Tracks) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, tracks)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _resolve(self, lavalink: lavasnek_rs.Lavalink, query: str, key: str) -> lavasnek_rs.Tracks:
+        redis_key = f"kangakari:tracks:{key}"
+
+        # Lavalink can only play tracks it loaded itself, so the shared tier keeps the identifier of the best
+        # match, loading that directly is a lot cheaper than a search
+        if (data := await self._redis_get(redis_key)) is not None:
+            tracks = await lavalink.get_tracks(msgpack.loads(data)["uri"])
+            if tracks.tracks:
+                self.redis_hits += 1
+                self._store(key, tracks)
+                return tracks
+
+        self.misses += 1
+        tracks = await lavalink.auto_search_tracks(query)
+        if tracks.tracks:
+            self._store(key, tracks)
+            info = tracks.tracks[0].info
+            await self._redis_set(redis_key, msgpack.dumps({"uri": info.uri, "title": info.title}))
+        return tracks
+
+    async def _redis_get(self, key: str) -> bytes | None:
+        try:
+            data: bytes | None = await self.redis_cache.get_connection(REDIS_INDEX).get(key)
+            return data
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not read the track cache from Redis", exc_info=True)
+            return None
+
+    async def _redis_set(self, key: str, data: bytes) -> None:
+        try:
+            await self.redis_cache.get_connection(REDIS_INDEX).set(key, data, ex=self.redis_ttl)
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not write the track cache to Redis", exc_info=True)
+
+
+# a restored track starts at the saved position instead of at 0
+_TRACK_START = """
+local offset = tonumber(redis.call('HGET', KEYS[1], 'offset') or '0')
+redis.call('HSET', KEYS[1], 'started_at', tonumber(ARGV[1]) - offset / 1000)
+redis.call('HDEL', KEYS[1], 'offset', 'paused_at')
+"""
+_RESUME = """
+local paused_at = redis.call('HGET', KEYS[1], 'paused_at')
+if not paused_at then
+  return
+end
+redis.call('HDEL', KEYS[1], 'paused_at')
+if redis.call('HEXISTS', KEYS[1], 'started_at') == 1 then
+  redis.call('HINCRBYFLOAT', KEYS[1], 'started_at', tonumber(ARGV[1]) - tonumber(paused_at))
+end
+"""
+
+
+class QueueStore:
+    # every guild's queue is mirrored to Redis as a list, the head of the list is the track that is playing
+    # the player is a hash and every change touches only its own fields in one command or script,
+    # so track events and commands that race don't overwrite each other
+
+    def __init__(self, redis_cache: sake.redis.ResourceClient, concurrency: int = 10):
+        self.redis_cache = redis_cache
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @property
+    def _redis(self) -> aioredis.Redis:
+        return self.redis_cache.get_connection(REDIS_INDEX)
+
+    @staticmethod
+    def _queue_key(guild_id: hikari.Snowflakeish) -> str:
+        return f"kangakari:queue:{int(guild_id)}"
+
+    @staticmethod
+    def _player_key(guild_id: hikari.Snowflakeish) -> str:
+        return f"kangakari:player_state:{int(guild_id)}"
+
+    async def _get_player(self, guild_id: hikari.Snowflakeish) -> dict[str, float]:
+        fields = await self._redis.hgetall(self._player_key(guild_id))
+        return {name.decode(): float(value) for name, value in fields.items()}
+
+    async def enqueue(
+        self,
+        guild_id: hikari.Snowflakeish,
+        channel_id: hikari.Snowflakeish,
+        track: lavasnek_rs.Track,
+        requester: hikari.Snowflakeish,
+    ) -> None:
+        entry = msgpack.dumps({"uri": track.info.uri, "title": track.info.title, "requester": int(requester)})
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(self._queue_key(guild_id), entry)
+                pipe.hset(self._player_key(guild_id), "channel_id", int(channel_id))
+                pipe.sadd("kangakari:players", int(guild_id))
+                await pipe.execute()
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not save the queue of guild %s", guild_id, exc_info=True)
+
+    async def track_start(self, guild_id: hikari.Snowflakeish) -> None:
+        try:
+            await self._redis.eval(_TRACK_START, 1, self._player_key(guild_id), time.time())
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not save the player of guild %s", guild_id, exc_info=True)
+
+    async def track_finish(self, guild_id: hikari.Snowflakeish) -> None:
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.lpop(self._queue_key(guild_id))
+                pipe.llen(self._queue_key(guild_id))
+                _, remaining = await pipe.execute()
+            if not remaining:
+                await self.clear(guild_id)
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not save the queue of guild %s", guild_id, exc_info=True)
+
+    async def pause(self, guild_id: hikari.Snowflakeish) -> None:
+        try:
+            await self._redis.hsetnx(self._player_key(guild_id), "paused_at", time.time())
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not save the player of guild %s", guild_id, exc_info=True)
+
+    async def resume(self, guild_id: hikari.Snowflakeish) -> None:
+        try:
+            await self._redis.eval(_RESUME, 1, self._player_key(guild_id), time.time())
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not save the player of guild %s", guild_id, exc_info=True)
+
+    async def clear(self, guild_id: hikari.Snowflakeish) -> None:
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.delete(self._queue_key(guild_id), self._player_key(guild_id))
+                pipe.srem("kangakari:players", int(guild_id))
+                await pipe.execute()
+        except (aioredis.RedisError, OSError):
+            log.warning("Could not clear the queue of guild %s", guild_id, exc_info=True)
+
+    async def guilds(self) -> list[int]:
+        return [int(guild_id) for guild_id in await self._redis.smembers("kangakari:players")]
+
+    async def restore(self, bot: hikari.GatewayBot, pool: NodePool, guild_id: int) -> None:
+        async with self._semaphore:
+            lavalink = pool.place(guild_id)
+            player = await self._get_player(guild_id)
+            entries = [msgpack.loads(entry) for entry in await self._redis.lrange(self._queue_key(guild_id), 0, -1)]
+            if not entries or "channel_id" not in player:
+                await self.clear(guild_id)
+                return
+
+            # identifier loads, no searches
+            results = await asyncio.gather(*(lavalink.get_tracks(entry["uri"]) for entry in entries))
+            loaded = [(entry, tracks.tracks[0]) for entry, tracks in zip(entries, results) if tracks.tracks]
+            if not loaded:
+                await self.clear(guild_id)
+                return
+
+            now = time.time()
+            position = int((player.get("paused_at", now) - player.get("started_at", now)) * 1000)
+            channel_id = int(player["channel_id"])
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.delete(self._queue_key(guild_id), self._player_key(guild_id))
+                pipe.rpush(self._queue_key(guild_id), *(msgpack.dumps(entry) for entry, _ in loaded))
+                pipe.hset(self._player_key(guild_id), mapping={"channel_id": channel_id, "offset": position})
+                await pipe.execute()
+
+            await bot.update_voice_state(guild_id, channel_id, self_deaf=True)
+            connection_info = await asyncio.wait_for(lavalink.wait_for_full_connection_info_insert(guild_id), 10)
+            await lavalink.create_session(connection_info)
+
+            for i, (entry, track) in enumerate(loaded):
+                builder = lavalink.play(guild_id, track).requester(entry["requester"])
+                if i == 0 and position > 0:
+                    builder = builder.start_time_millis(position)
+                await builder.queue()
+
+        log.info("Restored %d tracks on guild %s", len(loaded), guild_id)
+
+    async def restore_all(self, bot: hikari.GatewayBot, pool: NodePool, guild_ids: t.Sequence[int]) -> None:
+        results = await asyncio.gather(
+            *(self.restore(bot, pool, guild_id) for guild_id in guild_ids), return_exceptions=True
+        )
+        for guild_id, result in zip(guild_ids, results):
+            if isinstance(result, Exception):
+                log.warning("Could not restore the queue of guild %s", guild_id, exc_info=result)
+
+
+class Node:
+    __slots__ = ("host", "port", "lavalink", "guilds", "playing_players", "cpu_load", "frame_deficit", "alive")
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        # set once the client is built, the event handler needs the node before that
+        self.lavalink: lavasnek_rs.Lavalink
+        self.guilds: set[int] = set()
+        self.playing_players = 0
+        self.cpu_load = 0.0
+        self.frame_deficit = 0
+        self.alive = True
+
+    def __repr__(self) -> str:
+        return f"Node({self.host}:{self.port})"
+
+    @property
+    def penalty(self) -> float:
+        # the same weighting Lavalink clients commonly use, sessions placed since the last stats are counted too
+        players = max(self.playing_players, len(self.guilds))
+        cpu = 1.05 ** (100 * self.cpu_load) * 10 - 10
+        deficit = 1.03 ** (500 * self.frame_deficit / 3000) * 600 - 600 if self.frame_deficit > 0 else 0
+        return float(players + cpu + deficit)
+
+    def update_stats(self, stats: lavasnek_rs.Stats) -> None:
+        self.playing_players = stats.playing_players
+        self.cpu_load = stats.cpu_lavalink_load
+        self.frame_deficit = stats.frame_stats_deficit or 0
+
+
+class NoNodesAvailable(RuntimeError):
+    pass
+
+
+def _parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.partition(":")
+    return host, int(port or 2333)
+
+
+class NodePool:
+    def __init__(
+        self,
+        hosts: t.Sequence[str],
+        password: str,
+        queue_store: QueueStore,
+        check_interval: float = 30.0,
+    ):
+        self.hosts = hosts
+        self.password = password
+        self.queue_store = queue_store
+        self.check_interval = check_interval
+        self.nodes: list[Node] = []
+        self._guilds: dict[int, Node] = {}
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task[None] | None = None
+        # hosts that are down are retried on every check, but only reported once
+        self._unreachable: set[str] = set()
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.nodes)
+
+    async def connect(self, bot: hikari.GatewayBot, handler_factory: t.Callable[[Node], t.Any]) -> None:
+        # the first ready shard starts the pool, later ones and resumes find it running
+        async with self._lock:
+            if self._task is not None:
+                return
+            await self._connect_missing(bot, handler_factory)
+            self._task = asyncio.create_task(self._check(bot, handler_factory))
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _connect_missing(self, bot: hikari.GatewayBot, handler_factory: t.Callable[[Node], t.Any]) -> None:
+        user_id = t.cast(hikari.OwnUser, bot.get_me()).id
+        connected = {(node.host, node.port) for node in self.nodes}
+        for address in self.hosts:
+            host, port = _parse_address(address)
+            if (host, port) in connected:
+                continue
+
+            builder = lavasnek_rs.LavalinkBuilder(user_id, "").set_host(host).set_port(port).set_password(self.password)
+            builder.set_start_gateway(False)
+            node = Node(host, port)
+            try:
+                node.lavalink = await builder.build(handler_factory(node))
+            except Exception:
+                if address not in self._unreachable:
+                    log.warning(
+                        "Could not connect to Lavalink node %s, retrying in the background", address, exc_info=True
+                    )
+                    self._unreachable.add(address)
+                continue
+            self._unreachable.discard(address)
+            self.nodes.append(node)
+            log.info("Connected to Lavalink node %s", address)
+
+    def get(self, guild_id: hikari.Snowflakeish) -> lavasnek_rs.Lavalink:
+        # the node the guild is on, or the best node for guilds without a session
+        if (node := self._guilds.get(int(guild_id))) is not None:
+            return node.lavalink
+        return self._best().lavalink
+
+    def get_node(self, guild_id: hikari.Snowflakeish) -> Node | None:
+        return self._guilds.get(int(guild_id))
+
+    def place(self, guild_id: hikari.Snowflakeish) -> lavasnek_rs.Lavalink:
+        if (node := self._guilds.get(int(guild_id))) is None or not node.alive:
+            self.release(guild_id)
+            node = self._guilds[int(guild_id)] = self._best()
+            node.guilds.add(int(guild_id))
+        return node.lavalink
+
+    def release(self, guild_id: hikari.Snowflakeish) -> None:
+        if (node := self._guilds.pop(int(guild_id), None)) is not None:
+            node.guilds.discard(int(guild_id))
+
+    def _best(self) -> Node:
+        alive = [node for node in self.nodes if node.alive] or self.nodes
+        if not alive:
+            raise NoNodesAvailable("No Lavalink nodes are connected")
+        return min(alive, key=lambda node: node.penalty)
+
+    async def _probe(self, node: Node) -> bool:
+        try:
+            # a load that can't match anything, only to see whether the node answers
+            await asyncio.wait_for(node.lavalink.get_tracks("kangakari:healthcheck"), 5)
+        except Exception:
+            return False
+        return True
+
+    async def _check(self, bot: hikari.GatewayBot, handler_factory: t.Callable[[Node], t.Any]) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self._check_once(bot, handler_factory)
+            except Exception:
+                log.exception("Lavalink node check failed")
+
+    async def _check_once(self, bot: hikari.GatewayBot, handler_factory: t.Callable[[Node], t.Any]) -> None:
+        had_nodes = self.connected
+        await self._connect_missing(bot, handler_factory)
+        if not had_nodes and self.connected:
+            # queues that couldn't be restored when the shards became ready
+            guild_ids = [
+                guild_id
+                for guild_id in await self.queue_store.guilds()
+                if hikari.snowflakes.calculate_shard_id(bot, guild_id) in bot.shards and guild_id not in self._guilds
+            ]
+            await self.queue_store.restore_all(bot, self, guild_ids)
+
+        for node, alive in zip(self.nodes, await asyncio.gather(*(self._probe(node) for node in self.nodes))):
+            if alive == node.alive:
+                continue
+            node.alive = alive
+            if alive:
+                log.info("Lavalink node %r is back", node)
+                continue
+
+            log.warning("Lavalink node %r died, moving %d sessions", node, len(node.guilds))
+            guild_ids = list(node.guilds)
+            for guild_id in guild_ids:
+                self.release(guild_id)
+                # drop the old voice connection so Discord sends new voice server info for the new node
+                await bot.update_voice_state(guild_id, None)
+            await self.queue_store.restore_all(bot, self, guild_ids)
+
+
+__all__ = ["REDIS_INDEX", "NoNodesAvailable", "Node", "NodePool", "QueueStore", "TrackSearchCache", "normalize_query"]
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+import typing as t
+from collections import defaultdict
+
+from aiohttp import web
+
+from kangakari.utils.stats import Histogram
+
+if t.TYPE_CHECKING:
+    import lightbulb
+
+log = logging.getLogger(__name__)
+
+Labels = tuple[tuple[str, str], ...]
+
+# an invocation without a completion or error event is forgotten after this long, as long as interactions live
+STALE_AFTER = 15 * 60.0
+
+
+class Family(t.NamedTuple):
+    name: str
+    kind: str
+    help: str
+    samples: list[tuple[Labels, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metrics:
+    # everything is a dict update or a histogram bucket on the hot path, gauges are only read when scraped
+    def __init__(self) -> None:
+        self.commands: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.command_latency: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.command_errors: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.loop_lag = Histogram()
+        # keyed by the context itself, an id could be reused once it's freed and contexts can't be weakly referenced
+        self._started: dict[object, float] = {}
+        self._collectors: list[t.Callable[[], t.Iterable[Family]]] = []
+        self._task: asyncio.Task[None] | None = None
+
+    def command_started(self, context: object) -> None:
+        now = time.perf_counter()
+        # insertion ordered, the oldest invocations come first
+        while self._started and now - next(iter(self._started.values())) > STALE_AFTER:
+            del self._started[next(iter(self._started))]
+        self._started[context] = now
+
+    def command_finished(self, context: object, command: str, status: str) -> None:
+        if (start := self._started.pop(context, None)) is None:
+            return
+        self.commands[(command, status)] += 1
+        self.command_latency[command].observe(time.perf_counter() - start)
+
+    def command_failed(self, command: str, exception: BaseException) -> None:
+        self.command_errors[(command, type(exception).__name__)] += 1
+
+    def add_collector(self, collector: t.Callable[[], t.Iterable[Family]]) -> None:
+        self._collectors.append(collector)
+
+    def start(self, interval: float = 0.5) -> None:
+        assert self._task is None
+        self._task = asyncio.create_task(self._measure_loop_lag(interval))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _measure_loop_lag(self, interval: float) -> None:
+        # a sleep that wakes up late means something held the loop
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(loop.time() - start - interval, 0.0))
+
+    def _families(self) -> t.Iterator[Family]:
+        yield Family(
+            "kangakari_commands_total",
+            "counter",
+            "Finished command invocations.",
+            [((("command", command), ("status", status)), n) for (command, status), n in self.commands.items()],
+        )
+        yield Family(
+            "kangakari_command_errors_total",
+            "counter",
+            "Unhandled command errors by exception type.",
+            [((("command", command), ("error", error)), n) for (command, error), n in self.command_errors.items()],
+        )
+        for collector in self._collectors:
+            try:
+                yield from collector()
+            except Exception:
+                log.exception("Metrics collector %r failed", collector)
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for labels, value in family.samples:
+                lines.append(f"{family.name}{_format_labels(labels)} {_format_value(value)}")
+
+        self._render_histogram(
+            lines,
+            "kangakari_command_duration_seconds",
+            "Command execution time.",
+            [((("command", command),), histogram) for command, histogram in self.command_latency.items()],
+        )
+        self._render_histogram(
+            lines, "kangakari_event_loop_lag_seconds", "How late the event loop wakes up.", [((), self.loop_lag)]
+        )
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(lines: list[str], name: str, help_: str, histograms: list[tuple[Labels, Histogram]]) -> None:
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels((*labels, ('le', _format_value(bound))))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+
+class MetricsServer:
+    def __init__(self, metrics: Metrics, host: str, port: int):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("Serving metrics on %s:%d", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, _: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+def bot_collector(bot: lightbulb.BotApp) -> t.Callable[[], t.Iterable[Family]]:
+    def collect() -> t.Iterator[Family]:
+        yield Family(
+            "kangakari_gateway_latency_seconds",
+            "gauge",
+            "Heartbeat latency per shard.",
+            [((("shard", str(shard_id)),), shard.heartbeat_latency) for shard_id, shard in bot.shards.items()],
+        )
+
+        pool = bot.d.db.pool
+        yield Family(
+            "kangakari_db_connections",
+            "gauge",
+            "Connections in the Postgres pool.",
+            [
+                ((("state", "idle"),), pool.get_idle_size()),
+                ((("state", "in_use"),), pool.get_size() - pool.get_idle_size()),
+            ],
+        )
+
+        for name in ("hits", "misses", "evictions"):
+            yield Family(
+                f"kangakari_cache_{name}_total",
+                "counter",
+                f"In-process cache {name} in front of Redis.",
+                [((("resource", kind),), getattr(stats, name)) for kind, stats in bot.d.cache.stats.items()],
+            )
+
+        if (track_cache := getattr(bot.d, "track_cache", None)) is not None:
+            yield Family(
+                "kangakari_track_cache_lookups_total",
+                "counter",
+                "Track searches by the tier that answered them.",
+                [
+                    ((("result", "hit"),), track_cache.hits),
+                    ((("result", "redis_hit"),), track_cache.redis_hits),
+                    ((("result", "miss"),), track_cache.misses),
+                ],
+            )
+
+        if (lavalink := getattr(bot.d, "lavalink", None)) is not None:
+            samples: list[tuple[Labels, float]] = []
+            for node in lavalink.nodes:
+                node_label = ("node", f"{node.host}:{node.port}")
+                samples.append(((node_label, ("state", "placed")), len(node.guilds)))
+                samples.append(((node_label, ("state", "playing")), node.playing_players))
+            yield Family("kangakari_lavalink_players", "gauge", "Lavalink players per node.", samples)
+
+    return collect
+
+
+__all__ = ["Family", "Metrics", "MetricsServer", "bot_collector"]
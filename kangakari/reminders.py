@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import typing as t
+
+import hikari
+
+if t.TYPE_CHECKING:
+    from kangakari.jobs import JobQueue
+
+log = logging.getLogger(__name__)
+
+
+class Reminders:
+    # reminders are jobs, whichever process claims one delivers it
+    def __init__(self, rest: hikari.api.RESTClient, jobs: JobQueue):
+        self.rest = rest
+        self.jobs = jobs
+        jobs.register("reminder", self._deliver)
+
+    async def schedule(self, channel_id: int, user_id: int, text: str | None, due_at: datetime.datetime) -> int:
+        payload = {"channel_id": channel_id, "user_id": user_id, "text": text}
+        job_id = await self.jobs.enqueue("reminder", payload, due_at)
+        assert job_id is not None
+        return job_id
+
+    async def _deliver(self, payload: dict[str, t.Any]) -> None:
+        channel_id, user_id, text = payload["channel_id"], payload["user_id"], payload["text"]
+        content = f"<@{user_id}>\nReminder{f': `{text}`' if text else ''}"
+
+        try:
+            await self.rest.create_message(channel_id, content, user_mentions=[user_id])
+        except (hikari.ForbiddenError, hikari.NotFoundError):
+            try:
+                channel = await self.rest.create_dm_channel(user_id)
+                await channel.send(content)
+            except hikari.HTTPError:
+                log.warning("Could not deliver a reminder to %d", user_id, exc_info=True)
+
+
+__all__ = ["Reminders"]
@@ -1,29 +1,117 @@
+from __future__ import annotations
+
 import datetime
 import re
+import typing as t
+from functools import lru_cache
 
-TIMEDELTA_REGEX = re.compile(
-    r"((?P<years>\d+?)Y|years)?((?P<months>\d+?)M|months)?((?P<weeks>\d+?)W|weeks)?((?P<days>\d+?)D|days)?"
-    + r"((?P<hours>\d+?)h|hr|hours)?((?P<minutes>\d+?)m|min|minutes)?((?P<seconds>\d+?)s|sec|seconds)?"
-)
-TIME_TO_SECONDS = {
-    "years": 31_536_000,
-    "months": 2_628_288,
-    "weeks": 604_800,
-    "days": 86_400,
-    "hours": 3600,
-    "minutes": 60,
-    "seconds": 1,
+# "M" is a month and "m" a minute, every other unit is case insensitive
+UNITS = {
+    "M": 2_628_288,
+    **dict.fromkeys(("y", "yr", "yrs", "year", "years"), 31_536_000),
+    **dict.fromkeys(("mo", "mon", "mons", "month", "months"), 2_628_288),
+    **dict.fromkeys(("w", "wk", "wks", "week", "weeks"), 604_800),
+    **dict.fromkeys(("d", "day", "days"), 86_400),
+    **dict.fromkeys(("h", "hr", "hrs", "hour", "hours"), 3600),
+    **dict.fromkeys(("m", "min", "mins", "minute", "minutes"), 60),
+    **dict.fromkeys(("s", "sec", "secs", "second", "seconds"), 1),
 }
+# far enough for any reminder, and datetime arithmetic can't overflow with it
+MAX_DURATION = datetime.timedelta(days=100 * 365)
+ABSOLUTE_REGEX = re.compile(
+    r"(?:(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2}))?"
+    r"(?:(?:^|[ T])(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?)?"
+)
+
+
+class DurationError(ValueError):
+    pass
+
 
+class _Absolute(t.NamedTuple):
+    date: datetime.date | None
+    time: datetime.time | None
 
-def str_to_timedelta(timedelta_str: str) -> datetime.timedelta | None:
-    parts = TIMEDELTA_REGEX.match(timedelta_str)
-    seconds = 1.0  # to not error when your try to respond immediately
-    if parts is None:
-        return None
-    for k, v in parts.groupdict().items():
-        if v is None:
+
+@lru_cache(maxsize=1024)
+def _parse(text: str) -> int | _Absolute:
+    text = text.strip()
+    if not text:
+        raise DurationError("The duration is empty.")
+
+    if ":" in text or "-" in text:
+        return _parse_absolute(text)
+
+    seconds = 0
+    i, n = 0, len(text)
+    while i < n:
+        if text[i] in " ,":
+            i += 1
             continue
-        seconds += float(v) * TIME_TO_SECONDS[k]
 
-    return datetime.timedelta(seconds=seconds)
+        start = i
+        while i < n and text[i].isdecimal():
+            i += 1
+        if start == i:
+            raise DurationError(f"Expected a number at position {start + 1}, got `{text[start]}`.")
+        amount = int(text[start:i])
+
+        while i < n and text[i] == " ":
+            i += 1
+        unit_start = i
+        while i < n and text[i].isalpha():
+            i += 1
+        unit = text[unit_start:i]
+        if not unit:
+            raise DurationError(f"`{amount}` at position {start + 1} is missing a unit, like `s`, `m` or `h`.")
+        if (factor := UNITS.get(unit, UNITS.get(unit.lower()))) is None:
+            raise DurationError(f"Unknown unit `{unit}` at position {unit_start + 1}.")
+        seconds += amount * factor
+
+    if seconds > MAX_DURATION.total_seconds():
+        raise DurationError(f"`{text}` is longer than {MAX_DURATION.days // 365} years.")
+    return seconds
+
+
+def _parse_absolute(text: str) -> _Absolute:
+    if (match := ABSOLUTE_REGEX.fullmatch(text)) is None:
+        raise DurationError(f"`{text}` is not a date (`YYYY-MM-DD`), a time (`HH:MM`) or both.")
+
+    parts = match.groupdict()
+    try:
+        date = datetime.date(int(parts["year"]), int(parts["month"]), int(parts["day"])) if parts["year"] else None
+        time = (
+            datetime.time(int(parts["hour"]), int(parts["minute"]), int(parts["second"] or 0))
+            if parts["hour"]
+            else None
+        )
+    except ValueError as e:
+        raise DurationError(f"`{text}` is not a valid date or time: {e}.") from e
+    return _Absolute(date, time)
+
+
+def parse_duration(text: str, now: datetime.datetime | None = None) -> datetime.timedelta:
+    """Parse a duration like `1h30m` or `2 days`, or a date and/or time like `2022-01-31 13:00`.
+
+    Dates and times are in the timezone of `now` and are returned as the time from `now` until then,
+    a time without a date is the next time it is that time.
+    """
+    parsed = _parse(text)
+    if isinstance(parsed, int):
+        return datetime.timedelta(seconds=parsed)
+
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    wall_clock = now.replace(tzinfo=None)
+    date, time = parsed
+    target = datetime.datetime.combine(date or wall_clock.date(), time or datetime.time())
+    if date is None and target <= wall_clock:
+        target += datetime.timedelta(days=1)
+    if abs(target - wall_clock) > MAX_DURATION:
+        raise DurationError(f"`{text}` is more than {MAX_DURATION.days // 365} years away.")
+
+    # the target can have another UTC offset than now, pytz timezones only give it the right one through localize
+    localize = getattr(now.tzinfo, "localize", None)
+    return (localize(target) if localize else target.replace(tzinfo=now.tzinfo)) - now
+
+
+__all__ = ["DurationError", "MAX_DURATION", "UNITS", "parse_duration"]
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import copy
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import typing as t
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import RotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler
+
+FORMAT = "%(levelname)-1.1s %(asctime)23.23s %(name)s: %(message)s"
+
+_EXC_FORMATTER = logging.Formatter()
+
+
+class DroppingQueueHandler(QueueHandler):
+    # never blocks the caller, when the writer can't keep up records are dropped and counted
+
+    def __init__(self, queue_: queue.Queue[logging.LogRecord]):
+        super().__init__(queue_)
+        self.dropped = 0
+        self._reported_drops = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # like QueueHandler.prepare, but the traceback stays separate from the message for the JSON formatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        if self.dropped > self._reported_drops:
+            try:
+                self.queue.put_nowait(
+                    logging.makeLogRecord(
+                        {
+                            "name": __name__,
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": f"Dropped {self.dropped - self._reported_drops} log records",
+                        }
+                    )
+                )
+            except queue.Full:
+                return
+            self._reported_drops = self.dropped
+
+
+class _QueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # on shutdown wait for room instead of failing when the queue is full, None is the listener's sentinel
+        t.cast("queue.Queue[t.Any]", self.queue).put(None)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data)
+
+
+def _namer(name: str) -> str:
+    return f"{name}.gz"
+
+
+def _rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def setup_logging(
+    path: str,
+    *,
+    level: int = logging.DEBUG,
+    max_bytes: int = 10 * 1024 * 1024,
+    rotate_when: str | None = None,
+    backup_count: int = 10,
+    json_lines: bool = False,
+    queue_size: int = 10_000,
+) -> QueueListener:
+    # the file is only written by the listener's thread, the event loop only puts records on a queue
+    handler: RotatingFileHandler | TimedRotatingFileHandler
+    if rotate_when is None:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+    else:
+        handler = TimedRotatingFileHandler(
+            path, when=rotate_when, backupCount=backup_count, encoding="utf-8", delay=True
+        )
+    handler.namer = _namer
+    handler.rotator = _rotator
+    handler.setFormatter(JSONFormatter() if json_lines else logging.Formatter(FORMAT))
+    handler.setLevel(level)
+
+    queue_: queue.Queue[logging.LogRecord] = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(queue_)
+    queue_handler.setLevel(level)
+    logging.root.addHandler(queue_handler)
+
+    listener = _QueueListener(queue_, handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+__all__ = ["DroppingQueueHandler", "JSONFormatter", "setup_logging"]
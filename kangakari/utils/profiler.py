@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import typing as t
+from collections import Counter
+
+MAX_DEPTH = 128
+
+
+def _frame_name(code: t.Any) -> str:
+    # the last two path parts are enough to tell files apart, ";" separates frames in the collapsed format
+    path = "/".join(code.co_filename.replace(os.sep, "/").rsplit("/", 2)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+
+
+class Profile:
+    def __init__(self, stacks: Counter[tuple[str, ...]], samples: int, duration: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+
+    def collapsed(self) -> str:
+        # one "thread;outer;...;inner count" line per stack, what flamegraph.pl and speedscope read
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, n: int = 15) -> list[tuple[str, int, int]]:
+        # (function, samples where it was running, samples where it was on the stack)
+        own: Counter[str] = Counter()
+        total: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(frame, own[frame], total[frame]) for frame, _ in own.most_common(n)]
+
+
+class SamplingProfiler:
+    # samples every thread's stack from a thread of its own, the profiled code isn't touched
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+
+    def _run(self, duration: float) -> Profile:
+        own_id = threading.get_ident()
+        stacks: Counter[tuple[str, ...]] = Counter()
+        names: dict[int, str] = {}
+        labels: dict[t.Any, str] = {}
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + duration
+
+        while time.perf_counter() < deadline:
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = {thread.ident: thread.name for thread in threading.enumerate() if thread.ident is not None}
+
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack: list[str] = []
+                current: t.Any = frame
+                while current is not None and len(stack) < MAX_DEPTH:
+                    code = current.f_code
+                    if (label := labels.get(code)) is None:
+                        label = labels[code] = _frame_name(code)
+                    stack.append(label)
+                    current = current.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[tuple(reversed(stack))] += 1
+
+            del frames
+            samples += 1
+            time.sleep(self.interval)
+
+        return Profile(stacks, samples, time.perf_counter() - start)
+
+    async def profile(self, duration: float) -> Profile:
+        # a thread of its own rather than the default executor, which may be what's busy
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[Profile] = loop.create_future()
+
+        def target() -> None:
+            try:
+                profile = self._run(duration)
+            except BaseException as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+            else:
+                loop.call_soon_threadsafe(_set_result, future, profile)
+
+        threading.Thread(target=target, name="kangakari-profiler", daemon=True).start()
+        return await future
+
+
+def _set_result(future: asyncio.Future[Profile], profile: Profile) -> None:
+    if not future.done():
+        future.set_result(profile)
+
+
+def _set_exception(future: asyncio.Future[Profile], exception: BaseException) -> None:
+    if not future.done():
+        future.set_exception(exception)
+
+
+__all__ = ["Profile", "SamplingProfiler"]
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import bisect
+
+import pytz
+
+# abbreviations are ambiguous, these point to the zone most people mean by them
+ABBREVIATIONS = {
+    "UTC": "UTC",
+    "GMT": "Etc/GMT",
+    "WET": "Europe/Lisbon",
+    "BST": "Europe/London",
+    "CET": "Europe/Paris",
+    "CEST": "Europe/Paris",
+    "EET": "Europe/Athens",
+    "EEST": "Europe/Athens",
+    "MSK": "Europe/Moscow",
+    "IST": "Asia/Kolkata",
+    "SGT": "Asia/Singapore",
+    "HKT": "Asia/Hong_Kong",
+    "JST": "Asia/Tokyo",
+    "KST": "Asia/Seoul",
+    "AWST": "Australia/Perth",
+    "ACST": "Australia/Adelaide",
+    "AEST": "Australia/Sydney",
+    "AEDT": "Australia/Sydney",
+    "NZST": "Pacific/Auckland",
+    "NZDT": "Pacific/Auckland",
+    "HST": "Pacific/Honolulu",
+    "AKST": "America/Anchorage",
+    "AKDT": "America/Anchorage",
+    "PST": "America/Los_Angeles",
+    "PDT": "America/Los_Angeles",
+    "MST": "America/Denver",
+    "MDT": "America/Denver",
+    "CST": "America/Chicago",
+    "CDT": "America/Chicago",
+    "EST": "America/New_York",
+    "EDT": "America/New_York",
+    "BRT": "America/Sao_Paulo",
+}
+
+
+class TimezoneIndex:
+    # sorted (key, zone name) pairs, a prefix search is a bisect and a short scan
+    def __init__(self) -> None:
+        entries: set[tuple[str, str]] = set()
+        cities: dict[str, set[str]] = {}
+        for name in pytz.all_timezones:
+            entries.add((name.lower(), name))
+            # "amsterdam" finds Europe/Amsterdam
+            city = name.rpartition("/")[2].lower().replace("_", " ")
+            entries.add((city, name))
+            cities.setdefault(city, set()).add(name)
+        for abbreviation, name in ABBREVIATIONS.items():
+            entries.add((abbreviation.lower(), name))
+
+        pairs = sorted(entries)
+        self._keys = [key for key, _ in pairs]
+        self._names = [name for _, name in pairs]
+        # a city only resolves when it names one zone, or one current zone next to old aliases like
+        # America/Buenos_Aires, full names and abbreviations win over cities
+        self._exact = {}
+        for city, names in cities.items():
+            if len(names) > 1:
+                names = {name for name in names if name in pytz.common_timezones_set}
+            if len(names) == 1:
+                self._exact[city] = next(iter(names))
+        self._exact.update((name.lower(), name) for name in pytz.all_timezones)
+        self._exact.update((abbreviation.lower(), name) for abbreviation, name in ABBREVIATIONS.items())
+        self._zones: dict[str, pytz.BaseTzInfo] = {}
+
+    def search(self, prefix: str, limit: int = 25) -> list[str]:
+        prefix = prefix.strip().lower()
+        found: dict[str, None] = {}
+        for i in range(bisect.bisect_left(self._keys, prefix), len(self._keys)):
+            if len(found) >= limit or not self._keys[i].startswith(prefix):
+                break
+            found[self._names[i]] = None
+        return list(found)
+
+    def resolve(self, name: str) -> pytz.BaseTzInfo | None:
+        key = name.strip().lower()
+        if (zone_name := self._exact.get(key, self._exact.get(key.replace("_", " ")))) is None:
+            return None
+        if (zone := self._zones.get(zone_name)) is None:
+            zone = self._zones[zone_name] = pytz.timezone(zone_name)
+        return zone
+
+
+__all__ = ["ABBREVIATIONS", "TimezoneIndex"]
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import time
+import typing as t
+from contextlib import contextmanager
+
+T = t.TypeVar("T")
+
+
+class StartupTimer:
+    def __init__(self) -> None:
+        self.created = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def record(self, name: str, start: float) -> None:
+        self.phases[name] = time.perf_counter() - start
+
+    @contextmanager
+    def phase(self, name: str) -> t.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    async def run(self, name: str, awaitable: t.Awaitable[T]) -> T:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, start)
+
+    def report(self) -> dict[str, t.Any]:
+        return {
+            "total_ms": round((time.perf_counter() - self.created) * 1000, 1),
+            "phases_ms": {name: round(duration * 1000, 1) for name, duration in self.phases.items()},
+        }
+
+
+# created as early as possible, so the import phase is measured too
+STARTUP = StartupTimer()
+
+
+__all__ = ["STARTUP", "StartupTimer"]
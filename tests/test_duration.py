@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import datetime
+
+import pytest
+import pytz
+from hypothesis import given
+from hypothesis import strategies as st
+
+from kangakari.utils import helpers
+
+ALIASES: dict[int, list[str]] = {}
+for alias, factor in helpers.UNITS.items():
+    ALIASES.setdefault(factor, []).append(alias)
+
+NOW = datetime.datetime(2030, 6, 15, 12, 30, tzinfo=datetime.timezone.utc)
+MAX_SECONDS = int(helpers.MAX_DURATION.total_seconds())
+
+
+def _case(alias: str, upper: bool) -> str:
+    # "M" and "m" are different units, the other aliases can be written in any case
+    return alias.upper() if upper and alias.lower() not in ("m", "mo") else alias
+
+
+@st.composite
+def durations(draw: st.DrawFn) -> tuple[str, int]:
+    factors = draw(st.lists(st.sampled_from(sorted(ALIASES)), min_size=1, max_size=7))
+    parts = []
+    total = 0
+    for factor in factors:
+        amount = draw(st.integers(0, (MAX_SECONDS - total) // factor))
+        alias = _case(draw(st.sampled_from(ALIASES[factor])), draw(st.booleans()))
+        parts.append(f"{amount}{draw(st.sampled_from(['', ' ']))}{alias}")
+        total += amount * factor
+    return "".join(part + draw(st.sampled_from(["", " ", ", "])) for part in parts), total
+
+
+@given(durations())
+def test_round_trip(duration: tuple[str, int]) -> None:
+    text, seconds = duration
+    assert helpers.parse_duration(text, NOW) == datetime.timedelta(seconds=seconds)
+
+
+@given(st.integers(0, 100), st.sampled_from(sorted(ALIASES)))
+def test_aliases_agree(amount: int, factor: int) -> None:
+    results = {helpers.parse_duration(f"{amount}{alias}", NOW) for alias in ALIASES[factor]}
+    assert results == {datetime.timedelta(seconds=amount * factor)}
+
+
+@given(st.integers(0, 23), st.integers(0, 59))
+def test_mixed_forms(hours: int, minutes: int) -> None:
+    expected = datetime.timedelta(hours=hours, minutes=minutes)
+    assert helpers.parse_duration(f"{hours}h{minutes}m", NOW) == expected
+    assert helpers.parse_duration(f"{hours} hours, {minutes} minutes", NOW) == expected
+    assert helpers.parse_duration(f"{minutes}min {hours}hr", NOW) == expected
+
+
+@given(st.times())
+def test_bare_time_is_within_a_day(time: datetime.time) -> None:
+    delta = helpers.parse_duration(f"{time:%H:%M:%S}", NOW)
+    assert datetime.timedelta() < delta <= datetime.timedelta(days=1)
+    assert (NOW + delta).time() == time.replace(microsecond=0)
+
+
+@given(st.dates(datetime.date(2000, 1, 1), datetime.date(2100, 12, 31)), st.times())
+def test_date_and_time(date: datetime.date, time: datetime.time) -> None:
+    time = time.replace(microsecond=0)
+    delta = helpers.parse_duration(f"{date:%Y-%m-%d} {time:%H:%M:%S}", NOW)
+    assert NOW + delta == datetime.datetime.combine(date, time, NOW.tzinfo)
+
+
+@pytest.mark.parametrize(
+    ("now", "text", "expected"),
+    [
+        (datetime.datetime(2030, 3, 9, 12), "2030-03-10 12:00", "2030-03-10 12:00 EDT"),
+        (datetime.datetime(2030, 3, 10, 0, 30), "12:00", "2030-03-10 12:00 EDT"),
+        (datetime.datetime(2030, 11, 2, 12), "2030-11-03 12:00", "2030-11-03 12:00 EST"),
+    ],
+)
+def test_across_dst_changes(now: datetime.datetime, text: str, expected: str) -> None:
+    timezone = pytz.timezone("America/New_York")
+    now = timezone.localize(now)
+    assert f"{timezone.normalize(now + helpers.parse_duration(text, now)):%Y-%m-%d %H:%M %Z}" == expected
+
+
+@given(st.text())
+def test_only_duration_errors(text: str) -> None:
+    try:
+        helpers.parse_duration(text, NOW)
+    except helpers.DurationError:
+        pass
+
+
+@given(st.integers(MAX_SECONDS + 1))
+def test_too_long(seconds: int) -> None:
+    with pytest.raises(helpers.DurationError):
+        helpers.parse_duration(f"{seconds}s", NOW)
+
+
+@pytest.mark.parametrize(("text", "position"), [("1h x", 4), ("h", 1), ("10 parsecs", 4), ("5", 1), ("1h 30", 4)])
+def test_error_positions(text: str, position: int) -> None:
+    with pytest.raises(helpers.DurationError, match=f"position {position}"):
+        helpers.parse_duration(text, NOW)